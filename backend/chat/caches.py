@@ -0,0 +1,128 @@
+# backend/chat/caches.py
+
+import hashlib
+import uuid
+import numpy as np
+from django.core.cache import cache
+from documents.models import Document
+
+# Seconds a user's document filter is kept; signals drop it sooner whenever a document changes
+USER_DOC_FILTER_TTL = 60
+
+# Semantic answer cache: a new question reuses the answer to an earlier, near-identical one.
+# A hit returns an answer generated from the user's documents as they were when it was stored: it only
+# reflects later document changes because invalidate_user_rag_caches runs on every Document save/delete
+# and after every processing run. A change that bypasses those paths (e.g. QuerySet.update() or raw SQL
+# on documents or chunks) can keep serving answers over the old document set until ANSWER_CACHE_TTL.
+ANSWER_CACHE_TTL = 60 * 60
+ANSWER_CACHE_MAX_ENTRIES = 200 # Per user, most recent kept
+ANSWER_CACHE_MIN_SIMILARITY = 0.97
+ANSWER_ID_BYTES = 16
+# Index entries are answer ID + model tag + float32 vector; vectors of other embedding models are never compared
+ANSWER_MODEL_TAG_BYTES = 8
+ANSWER_ENTRY_HEADER_BYTES = ANSWER_ID_BYTES + ANSWER_MODEL_TAG_BYTES
+
+
+def user_doc_filter_cache_key(user_id):
+    return f"user_doc_filter:{user_id}"
+
+
+def get_user_doc_filter(user_id):
+    """
+    Returns the Pinecone metadata filter restricting a query to the user's documents,
+    or None when they have none. The filter is built once and kept in the shared Django cache,
+    so the web process and the RQ workers all see the same value and the same invalidation.
+    The returned dict is shared between callers and must not be mutated.
+    """
+    key = user_doc_filter_cache_key(user_id)
+    filter_dict = cache.get(key)
+    if filter_dict is None:
+        # Sorted so the same document set always produces the same filter (and Pinecone cache key)
+        document_ids = sorted(map(str, Document.objects.filter(user_id=user_id).values_list('id', flat=True)))
+        # An empty dict is cached for users without documents, since None means "not cached"
+        filter_dict = {"document_id": {"$in": document_ids}} if document_ids else {}
+        cache.set(key, filter_dict, USER_DOC_FILTER_TTL)
+    return filter_dict or None
+
+
+def user_doc_version_cache_key(user_id):
+    return f"user_doc_version:{user_id}"
+
+
+def get_user_doc_version(user_id):
+    """
+    Returns a token that changes whenever the user's documents or their chunks change (it is dropped by
+    invalidate_user_rag_caches), for caches derived from them that live outside Redis.
+    """
+    return cache.get_or_set(user_doc_version_cache_key(user_id), lambda: uuid.uuid4().hex, None)
+
+
+def user_answer_cache_key(user_id):
+    return f"rag_answers:{user_id}"
+
+
+def answer_cache_key(user_id, model_name, answer_id):
+    return f"rag_answer:{user_id}:{model_name}:{answer_id.hex()}"
+
+
+def _answer_model_tag(model_name):
+    return hashlib.blake2b(model_name.encode('utf-8'), digest_size=ANSWER_MODEL_TAG_BYTES).digest()
+
+
+def _redis_client():
+    # Raw client behind Django's RedisCache, for the list commands the cache API doesn't expose
+    return cache._cache.get_client(write=True)
+
+
+def get_cached_answer(user_id, model_name, query_embedding):
+    """
+    Returns the {'content', 'sources'} of an earlier answer to this user whose question embedding, from the
+    same embedding model `model_name`, has cosine similarity >= ANSWER_CACHE_MIN_SIMILARITY with
+    `query_embedding`, or None. The user's index is one Redis list of raw float32 vectors, compared in one
+    matrix-vector product; only the answers above the threshold are fetched.
+    """
+    entries = _redis_client().lrange(cache.make_key(user_answer_cache_key(user_id)), 0, -1)
+    model_tag = _answer_model_tag(model_name)
+    entries = [entry for entry in entries if entry[ANSWER_ID_BYTES:ANSWER_ENTRY_HEADER_BYTES] == model_tag]
+    if not entries:
+        return None
+    embeddings = np.frombuffer(b"".join(entry[ANSWER_ENTRY_HEADER_BYTES:] for entry in entries), dtype=np.float32).reshape(len(entries), -1)
+    similarities = embeddings @ np.asarray(query_embedding, dtype=np.float32) # Both sides are L2-normalized
+    candidates = np.flatnonzero(similarities >= ANSWER_CACHE_MIN_SIMILARITY)
+    if not len(candidates):
+        return None
+
+    # Most similar first; an index entry may outlive its answer, so fall through to the next one
+    keys = [answer_cache_key(user_id, model_name, entries[i][:ANSWER_ID_BYTES]) for i in candidates[np.argsort(-similarities[candidates])]]
+    answers = cache.get_many(keys)
+    for key in keys:
+        if key in answers:
+            return answers[key]
+    return None
+
+
+def store_answer(user_id, model_name, query_embedding, content, sources):
+    """
+    Remembers an answer for later near-identical questions from the same user, embedded by `model_name`.
+    The answer is stored under its own key (a digest of the question embedding) and its vector is pushed
+    onto the user's index with LPUSH + LTRIM in one MULTI, so concurrent jobs never drop each other's entries.
+    """
+    embedding = np.asarray(query_embedding, dtype=np.float32).tobytes()
+    answer_id = hashlib.blake2b(embedding, digest_size=ANSWER_ID_BYTES).digest()
+    cache.set(answer_cache_key(user_id, model_name, answer_id), {'content': content, 'sources': sources}, ANSWER_CACHE_TTL)
+
+    index_key = cache.make_key(user_answer_cache_key(user_id))
+    pipeline = _redis_client().pipeline(transaction=True)
+    pipeline.lpush(index_key, answer_id + _answer_model_tag(model_name) + embedding)
+    pipeline.ltrim(index_key, 0, ANSWER_CACHE_MAX_ENTRIES - 1)
+    pipeline.expire(index_key, ANSWER_CACHE_TTL)
+    pipeline.execute()
+
+
+def invalidate_user_rag_caches(user_id):
+    """
+    Drops everything cached from the user's documents: the Pinecone filter, the cached answers
+    (deleting the answer index is enough; the orphaned answers expire on their own) and the document
+    version, so process-local caches keyed on it are rebuilt.
+    """
+    cache.delete_many([user_doc_filter_cache_key(user_id), user_answer_cache_key(user_id), user_doc_version_cache_key(user_id)])
@@ -1,11 +1,11 @@
 # backend/chat/consumers.py
 
-import json
+import orjson
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.shortcuts import get_object_or_404
 from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.exceptions import TokenError
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
 
 import logging
 logger = logging.getLogger(__name__)
@@ -13,31 +13,46 @@ logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+class SimpleLazyUser:
+    """
+    Minimal user built from a verified access token's claims, for a user confirmed to still exist.
+    """
+    is_authenticated = True
+
+    def __init__(self, id):
+        self.id = id
+
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        self.user = None
         self.session_id = self.scope['url_route']['kwargs']['session_id']
         self.room_group_name = f'chat_{self.session_id}'
 
         # Get the token from the query string
-        query_string = self.scope['query_string'].decode()
-        token_str = query_string.split('token=')[1] if 'token=' in query_string else None
+        query_params = parse_qs(self.scope['query_string'].decode())
+        token_str = query_params.get('token', [None])[0]
 
         if not token_str:
             await self.close(code=4001) # Close if no token
             return
 
         try:
-            # Validate the token and get the user
+            # Validate the token (signature + expiry) without a database round-trip
             access_token = AccessToken(token_str)
             user_id = access_token['user_id']
-            self.user = await self.get_user_from_id(user_id)
-            if self.user.is_authenticated:
-                await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-                await self.accept()
-            else:
-                await self.close(code=4002) # Close if user is not authenticated
-        except (ObjectDoesNotExist, Exception) as e:
+        except (TokenError, KeyError):
             await self.close(code=4003) # Close on token validation failure
+            return
+
+        # A valid token can outlive its user: reject deleted accounts with one primary-key EXISTS
+        # (users.User has no is_active column to check)
+        if not await User.objects.filter(pk=user_id).aexists():
+            await self.close(code=4003)
+            return
+
+        self.user = SimpleLazyUser(id=user_id)
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
 
     async def disconnect(self, close_code):
         if self.user and self.user.is_authenticated:
@@ -45,11 +60,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def chat_message(self, event):
         message = event['message']
-        await self.send(text_data=json.dumps(message))
+        await self.send(text_data=orjson.dumps(message).decode())
 
-    async def get_user_from_id(self, user_id):
-        # Asynchronously get the user to avoid blocking
-        try:
-            return await User.objects.aget(id=user_id)
-        except User.DoesNotExist:
-            return None
\ No newline at end of file
+    async def chat_message_delta(self, event):
+        # Partial AI reply while Gemini is still streaming: {'type', 'message_id', 'delta'}
+        await self.send(text_data=orjson.dumps(event).decode())
@@ -0,0 +1,190 @@
+# backend/chat/embeddings.py
+
+import os
+import numpy as np
+import torch
+from django.conf import settings
+from sentence_transformers import SentenceTransformer
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Bound torch's CPU threads per process so (web + RQ workers) x threads stays within the physical cores
+torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS", "4")))
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    pass # Already configured in this process (can only be set once)
+
+
+class OnnxMiniLM:
+    """
+    int8-quantized ONNX Runtime build of all-MiniLM-L6-v2 with a SentenceTransformer-like `.encode()`.
+    Runs the same pipeline as the PyTorch model: tokenize, forward pass, mean-pool over the
+    attention mask and L2-normalize, so its vectors stay compatible with the Pinecone index.
+    """
+    def __init__(self, model_id, subfolder='', file_name='model_quantized.onnx', max_length=256):
+        # Optional dependencies, only needed when the ONNX model is used
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2)
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_id,
+            subfolder=subfolder,
+            file_name=file_name,
+            provider="CPUExecutionProvider",
+            session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.file_name = file_name
+        self.max_length = max_length
+        self.max_seq_length = max_length # SentenceTransformer's name for it, used by the document chunker
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.config.hidden_size
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """
+        Returns float32 embeddings: a (384,) array for a single string, (n, 384) for a list.
+        Lists are encoded in length-sorted mini-batches of `batch_size`, as SentenceTransformer does.
+        Other SentenceTransformer keyword arguments are accepted and ignored.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if len(texts) <= batch_size:
+            embeddings = self._encode_batch(texts)
+            return embeddings[0] if single else embeddings
+
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            embeddings[batch] = self._encode_batch([texts[i] for i in batch])
+        return embeddings
+
+    def _encode_batch(self, texts):
+        inputs = self.tokenizer(
+            texts,
+            max_length=self.max_length,
+            truncation=True,
+            padding=True,
+            return_tensors='np'
+        )
+        outputs = self.model(**inputs)
+        token_embeddings = np.asarray(outputs.last_hidden_state, dtype=np.float32)
+
+        # Mean-pool over real tokens only, then L2-normalize
+        mask = inputs['attention_mask'][..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        embeddings = summed / counts
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+
+class StaticMiniLM:
+    """
+    Model2Vec static embeddings distilled from all-MiniLM-L6-v2: a token-embedding lookup plus mean pooling,
+    with no transformer layers at query time. The vectors approximate (not reproduce) the MiniLM space,
+    so retrieval quality should be checked against the existing index before enabling it.
+    """
+    def __init__(self, path):
+        # Optional dependency, only needed when the static model is used
+        from model2vec import StaticModel
+
+        self.model = StaticModel.from_pretrained(path)
+        self.path = path
+
+    def encode(self, sentences, **kwargs):
+        """
+        Returns L2-normalized float32 embeddings: a (384,) array for a single string, (n, 384) for a list.
+        Extra SentenceTransformer keyword arguments are accepted and ignored.
+        """
+        single = isinstance(sentences, str)
+        embeddings = np.asarray(self.model.encode([sentences] if single else list(sentences)), dtype=np.float32)
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+
+def embedding_model_name(model):
+    """
+    Names the model that produces a vector (stored as Document.embedding_model and in cache keys),
+    so vectors from different models or builds are never compared with each other.
+    """
+    if isinstance(model, StaticMiniLM):
+        return f"static:{model.path}"
+    if isinstance(model, OnnxMiniLM):
+        return f"all-MiniLM-L6-v2:onnx:{model.file_name}"
+    return 'all-MiniLM-L6-v2'
+
+
+def detect_device():
+    """
+    Picks the torch device for SentenceTransformer: RAG_EMBED_DEVICE if set, else CUDA, then MPS, then CPU.
+    """
+    override = os.getenv("RAG_EMBED_DEVICE")
+    if override:
+        return override
+    try:
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+    except Exception:
+        pass
+    return "cpu"
+
+
+def load_query_embedding_model():
+    """
+    Loads the model used to embed chat questions. A distilled static model is used when
+    RAG_STATIC_MODEL_PATH is set. Otherwise, on a GPU/MPS host the SentenceTransformer runs
+    on that device; on CPU the quantized ONNX build is preferred, falling back to the regular
+    SentenceTransformer if it (or onnxruntime) is unavailable.
+    """
+    if settings.RAG_STATIC_MODEL_PATH:
+        try:
+            model = StaticMiniLM(settings.RAG_STATIC_MODEL_PATH)
+            logger.info("RAG: Static embedding model '%s' loaded for query embedding.", settings.RAG_STATIC_MODEL_PATH)
+            return model
+        except Exception as e:
+            logger.warning("RAG: Static embedding model unavailable, falling back to the transformer model: %s", e)
+
+    device = detect_device()
+    if device == "cpu":
+        try:
+            model = OnnxMiniLM(
+                settings.RAG_ONNX_MODEL_ID,
+                subfolder=settings.RAG_ONNX_SUBFOLDER,
+                file_name=settings.RAG_ONNX_FILE_NAME
+            )
+            logger.info("RAG: Quantized ONNX model '%s' loaded for query embedding.", settings.RAG_ONNX_FILE_NAME)
+            return model
+        except Exception as e:
+            logger.warning("RAG: ONNX embedding model unavailable, falling back to SentenceTransformer: %s", e)
+
+    model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+    model.eval() # Inference only: no dropout
+    if device == "cuda":
+        model.half() # fp16 halves memory traffic on GPU; encode_query hands back float32 either way
+    logger.info("RAG: SentenceTransformer model 'all-MiniLM-L6-v2' loaded for query embedding on '%s'.", device)
+    return model
+
+
+def encode_query(model, text):
+    """
+    Returns the normalized float32 embedding of one question, encoded directly on the calling thread.
+    """
+    with torch.inference_mode(): # No autograd bookkeeping for the forward pass
+        embedding = model.encode(
+            text,
+            convert_to_numpy=True,
+            normalize_embeddings=True, # Normalized once here so cosine math downstream doesn't redo it
+            show_progress_bar=False
+        )
+    return np.asarray(embedding, dtype=np.float32) # fp16 models on GPU return float16
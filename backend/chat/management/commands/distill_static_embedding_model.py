@@ -0,0 +1,32 @@
+# backend/chat/management/commands/distill_static_embedding_model.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Distills all-MiniLM-L6-v2 into a Model2Vec static model that embeds into the same 384-d index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-id', default='sentence-transformers/all-MiniLM-L6-v2')
+        parser.add_argument('--output-dir', default=str(settings.BASE_DIR / 'static_models' / 'all-MiniLM-L6-v2'))
+
+    def handle(self, *args, **options):
+        try:
+            # Optional dependency, only needed to build the model
+            from model2vec.distill import distill
+        except ImportError as e:
+            raise CommandError(f"model2vec[distill] is required to distill the model: {e}")
+
+        model_id = options['model_id']
+        output_dir = options['output_dir']
+
+        self.stdout.write(f"Distilling {model_id} into {output_dir}...")
+        # No PCA, so the output keeps the 384 dimensions of the Pinecone index
+        static_model = distill(model_name=model_id, pca_dims=None)
+        static_model.save_pretrained(output_dir)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Static model written. Compare its retrieval results with the current model, then set:\n"
+            f"RAG_STATIC_MODEL_PATH={output_dir}"
+        ))
@@ -0,0 +1,46 @@
+# backend/chat/management/commands/export_onnx_embedding_model.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Exports all-MiniLM-L6-v2 to ONNX and quantizes it to int8 for CPU query embeddings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-id', default='sentence-transformers/all-MiniLM-L6-v2')
+        parser.add_argument('--output-dir', default=str(settings.BASE_DIR / 'onnx_models' / 'all-MiniLM-L6-v2'))
+        parser.add_argument(
+            '--arch',
+            choices=['avx512_vnni', 'avx512', 'avx2', 'arm64'],
+            default='avx512_vnni',
+            help="CPU instruction set the quantized kernels are tuned for (match the production host)."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            # Optional dependencies, only needed to build the model
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise CommandError(f"optimum[onnxruntime] is required to export the model: {e}")
+
+        model_id = options['model_id']
+        output_dir = options['output_dir']
+
+        self.stdout.write(f"Exporting {model_id} to ONNX in {output_dir}...")
+        model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+        model.save_pretrained(output_dir)
+        AutoTokenizer.from_pretrained(model_id).save_pretrained(output_dir)
+
+        # Dynamic quantization: int8 weights, activations quantized on the fly, so no calibration data is needed
+        quantization_config = getattr(AutoQuantizationConfig, options['arch'])(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(model).quantize(save_dir=output_dir, quantization_config=quantization_config)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Quantized model written. To use it for query embeddings set:\n"
+            f"RAG_ONNX_MODEL_ID={output_dir}\n"
+            "RAG_ONNX_SUBFOLDER=\n"
+            "RAG_ONNX_FILE_NAME=model_quantized.onnx"
+        ))
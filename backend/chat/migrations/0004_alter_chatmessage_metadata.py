@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-15 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chatsession_chatmessage_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='metadata',
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
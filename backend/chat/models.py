@@ -15,6 +15,9 @@ class ChatSession(models.Model):
     class Meta:
         verbose_name = "Chat Session"
         verbose_name_plural = "Chat Sessions"
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='chatsess_user_created_idx'), # Session list per user
+        ]
 
 class ChatMessage(models.Model):
     """
@@ -26,7 +29,7 @@ class ChatMessage(models.Model):
     is_helpful = models.BooleanField(null=True, blank=True) 
     feedback_text = models.TextField(blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
-    metadata = models.JSONField(default=dict, blank=True, null=True) 
+    metadata = models.JSONField(default=None, blank=True, null=True) # NULL unless there is something to store (e.g. AI sources)
     
 
     def __str__(self):
@@ -35,4 +38,7 @@ class ChatMessage(models.Model):
     class Meta:
         verbose_name = "Chat Message"
         verbose_name_plural = "Chat Messages"
-        ordering = ['timestamp'] # Order messages by time
\ No newline at end of file
+        ordering = ['timestamp'] # Order messages by time
+        indexes = [
+            models.Index(fields=['session', 'timestamp'], name='chatmsg_sess_ts_idx'), # Message history per session
+        ]
\ No newline at end of file
@@ -0,0 +1,628 @@
+# backend/chat/tasks.py
+
+from django.db.transaction import atomic, on_commit
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from .models import ChatSession, ChatMessage
+from .embeddings import load_query_embedding_model, embedding_model_name, encode_query
+
+import requests 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import logging
+import re
+import hashlib
+import operator
+import threading
+import time
+from collections import OrderedDict
+from functools import reduce
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import numpy as np
+import orjson
+from pinecone import Pinecone, PodSpec
+try:
+    from pinecone.grpc import PineconeGRPC # Installed with the pinecone[grpc] extra
+except ImportError:
+    PineconeGRPC = None
+from django.conf import settings 
+from django.core.cache import cache
+from django.db.models import Count, Q
+from documents.models import DocumentChunk
+from .caches import get_user_doc_filter, get_user_doc_version, get_cached_answer, store_answer
+
+logger = logging.getLogger(__name__)
+
+# --- Global Initialization for Efficiency ---
+# Loaded once per RQ worker process by load_rag_resources(): chat.workers.RAGWorker calls it before its first
+# job and runs every job in that same process. The web process only enqueues jobs and never imports this module.
+
+embedding_model_rag = None
+embedding_model_name_rag = None # Compared with Document.embedding_model before searching stored chunk vectors directly
+pinecone_index_rag = None
+pc = None # New Pinecone client instance
+
+# Seconds a single Pinecone query may take before the answer is generated without retrieved context
+PINECONE_QUERY_TIMEOUT = 5
+
+def load_rag_resources():
+    """
+    Loads the query embedding model and connects to Pinecone, skipping whichever is already loaded.
+    Called before every job, so a resource whose initialization failed (a model download, Pinecone being
+    unreachable) is retried by the next job instead of staying unavailable for the rest of the worker's life.
+    """
+    global embedding_model_rag, embedding_model_name_rag, pinecone_index_rag, pc
+    if embedding_model_rag is None:
+        try:
+            model = load_query_embedding_model()
+            embedding_model_name_rag = embedding_model_name(model)
+            embedding_model_rag = model
+        except Exception as e:
+            logger.exception("RAG: Error loading embedding model: %s", e)
+
+    if pinecone_index_rag is None:
+        try:
+            # Initialize Pinecone using the new client instantiation
+            # Use PodSpec if your index is not serverless, otherwise use ServerlessSpec
+            # The gRPC client keeps one multiplexed HTTP/2 channel open for all queries; fall back to REST without it
+            pinecone_client_class = PineconeGRPC or Pinecone
+            pc = pinecone_client_class(
+                api_key=settings.PINECONE_API_KEY,
+                environment=settings.PINECONE_ENVIRONMENT
+            )
+            # Access the index via the Pinecone client instance
+            pinecone_index_rag = pc.Index(settings.PINECONE_INDEX_NAME)
+            logger.info("RAG: Pinecone (%s) initialized and connected to index: %s", 'gRPC' if PineconeGRPC else 'REST', settings.PINECONE_INDEX_NAME)
+        except Exception as e:
+            logger.exception("RAG: Error initializing Pinecone: %s", e)
+            pc = None # Set to None if initialization fails
+            pinecone_index_rag = None # Set to None if initialization fails
+
+# The gRPC index takes a `timeout` per call, the REST (OpenAPI) one `_request_timeout`
+PINECONE_QUERY_KWARGS = {'timeout': PINECONE_QUERY_TIMEOUT} if PineconeGRPC else {'_request_timeout': PINECONE_QUERY_TIMEOUT}
+
+# Embeds the question while the session and the user's document filter are looked up
+prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rag-prefetch')
+
+# Process-wide HTTP session for Gemini: keep-alive connections are reused across requests,
+# so only the first call pays the TCP + TLS handshake
+# Every Gemini call is a non-idempotent POST, so only requests the server never processed are retried:
+# failed connections and 429/503 rejections. Read errors are not retried (read=0).
+gemini_session = requests.Session()
+gemini_session.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, read=0, backoff_factor=0.2, status_forcelist=[429, 503], allowed_methods=None)
+))
+
+# --- End Global Initialization ---
+
+# Replies sent without calling Gemini (see settings.RAG_SKIP_LLM_WHEN_EMPTY)
+NO_DOCUMENTS_RESPONSE = "I don't have any documents to reference yet. Please upload a document to get started."
+LOW_CONFIDENCE_RESPONSE = (
+    "I couldn't find anything in your uploaded documents that answers this question. "
+    "Try rephrasing it, or upload a document that covers this topic."
+)
+
+# Constant parts of every Gemini request, built once per process
+SYSTEM_PROMPT = """You are a helpful AI assistant. Answer the user's question based on the provided context.
+
+Instructions:
+- Use the context provided to answer the question thoroughly and comprehensively
+- If the context contains relevant information, provide a detailed answer
+- If the context doesn't contain enough information, explain what you can determine from the available context and suggest what additional information might be needed
+- Always be specific about which parts of the context support your answer
+- Synthesize information from multiple context sections if relevant"""
+
+GEMINI_STREAM_URL = f"{settings.GEMINI_STREAM_API_BASE_URL}?alt=sse&key={settings.GEMINI_API_KEY}"
+GEMINI_HEADERS = {
+    'Content-Type': 'application/json',
+}
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.3,  # Lower temperature for more focused responses
+    "maxOutputTokens": 2048,  # Allow longer responses
+    "topP": 0.8,
+    "topK": 40
+}
+
+# Limits on the retrieved text sent to Gemini (input tokens drive both latency and cost)
+CONTEXT_CHUNK_CHARS = 1500
+CONTEXT_BUDGET_CHARS = 6000
+
+
+class _QueryEmbeddingCache:
+    """
+    Thread-safe, process-local LRU cache with a TTL on every entry.
+    Used to skip the embedding forward pass and the Pinecone round-trip for repeated questions.
+    """
+    def __init__(self, max_size=2048, ttl_seconds=300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key) # Mark as most recently used
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False) # Evict the least recently used entry
+
+
+# Embeddings are deterministic for a given text, so they can be kept much longer than search results
+QUERY_EMBEDDING_TTL = 12 * 60 * 60
+query_embedding_cache = _QueryEmbeddingCache(max_size=4096, ttl_seconds=QUERY_EMBEDDING_TTL)
+pinecone_query_cache = _QueryEmbeddingCache(max_size=10000, ttl_seconds=600)
+# Per-user (chunk IDs, embedding matrix) for _local_chunk_search, keyed on the user's document version;
+# False marks users whose chunks must be searched in Pinecone
+local_chunk_matrix_cache = _QueryEmbeddingCache(max_size=64, ttl_seconds=600)
+
+
+def _hash_text(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _normalize_query(text):
+    # all-MiniLM-L6-v2 is uncased and ignores runs of whitespace, so this doesn't change the embedding
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+def _get_or_compute_embedding(text):
+    """
+    Returns the query embedding for `text` as a read-only float32 array, encoding it only on a cache miss.
+    Looks in the process-local LRU first, then in the shared Django cache (Redis),
+    so a question embedded by one worker is reused by every other one.
+    """
+    normalized = _normalize_query(text)
+    key = _hash_text(normalized)
+    embedding = query_embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+
+    if embedding_model_rag is None:
+        raise RuntimeError("Query embedding model is not loaded; check the worker's startup logs.")
+    # Keyed on the model too: workers running another model (static, ONNX, GPU) must not reuse these vectors
+    shared_key = f"rag:query_embedding:{embedding_model_name_rag}:{key}"
+    packed = cache.get(shared_key)
+    if packed is not None:
+        embedding = np.frombuffer(packed, dtype=np.float32) # Zero-copy view, already read-only
+    else:
+        embedding = encode_query(embedding_model_rag, normalized)
+        cache.set(shared_key, embedding.tobytes(), QUERY_EMBEDDING_TTL) # 1.5 KB of raw float32
+        embedding.setflags(write=False) # Shared through the cache, so it must never be modified in place
+    query_embedding_cache.put(key, embedding)
+    return embedding
+
+
+def _trim_chunk(text, limit=CONTEXT_CHUNK_CHARS):
+    """
+    Cuts `text` to at most `limit` characters, ending at the last full sentence when there is one.
+    """
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    cut = head.rfind('. ')
+    return head[:cut + 1] if cut > 0 else head
+
+
+def _select_context(matches):
+    """
+    Picks the chunk texts sent to Gemini from `matches` (best first) and their citations.
+    Matches with incomplete metadata and near-duplicates (same opening 256 characters) are skipped, each chunk
+    is trimmed with _trim_chunk, and chunks stop being added once CONTEXT_BUDGET_CHARS would be exceeded.
+    Returns (retrieved_context, source_citations).
+    """
+    retrieved_context = []
+    source_citations = []
+    seen_chunks = set() # Digests of chunk openings, to drop near-duplicate chunks
+    context_chars = 0
+    for match in matches:
+        # Use FULL CONTENT instead of snippet for better context
+        chunk_content = match.get('metadata', {}).get('full_content')
+        if not chunk_content:  # Fallback to snippet for vectors indexed before full_content was stored
+            chunk_content = match.get('metadata', {}).get('content_snippet')
+
+        document_id_str = match.get('metadata', {}).get('document_id')
+        filename = match.get('metadata', {}).get('filename')
+        chunk_position = match.get('metadata', {}).get('chunk_position')
+        score = match.get('score') # Similarity score
+
+        # Only add to context/citations if all required fields are present and chunk_content is not empty
+        if not (chunk_content and document_id_str and filename and chunk_position is not None and score is not None):
+            logger.debug("RAG: Skipping match due to missing or incomplete metadata fields: %s", match)
+            continue
+
+        chunk_key = hashlib.blake2b(chunk_content[:256].encode('utf-8'), digest_size=8).digest()
+        if chunk_key in seen_chunks:
+            logger.debug("RAG: Skipping duplicate chunk %s from %s", chunk_position, filename)
+            continue
+
+        chunk_content = _trim_chunk(chunk_content)
+        if context_chars + len(chunk_content) > CONTEXT_BUDGET_CHARS:
+            logger.debug("RAG: Context budget of %d chars reached, dropping lower-scored chunks", CONTEXT_BUDGET_CHARS)
+            break
+        seen_chunks.add(chunk_key)
+        context_chars += len(chunk_content)
+
+        retrieved_context.append(chunk_content)
+        source_citations.append({
+            "document_id": document_id_str,
+            "filename": filename,
+            "chunk_position": chunk_position,
+            "score": score
+        })
+        logger.debug("RAG: Added chunk %s from %s, score: %.3f, length: %d chars", chunk_position, filename, score, len(chunk_content))
+    return retrieved_context, source_citations
+
+
+def _cached_pinecone_query(query_embedding, docs_filter, top_k):
+    """
+    Queries Pinecone for the user's documents, reusing a recent response for the same vector and document set.
+    The cache key buckets the vector by quantizing it to int8, so near-identical questions share a cached
+    response; Pinecone itself is always queried with the original float vector.
+    """
+    quantized = np.clip(np.rint(query_embedding * 127), -127, 127).astype(np.int8)
+    vector_bucket = hashlib.blake2b(quantized.tobytes(), digest_size=16).hexdigest()
+    # IDs are already sorted by get_user_doc_filter
+    docs_digest = hashlib.blake2b(",".join(docs_filter["document_id"]["$in"]).encode('utf-8'), digest_size=8).hexdigest()
+    key = (docs_digest, vector_bucket, top_k)
+    results = pinecone_query_cache.get(key)
+    if results is None:
+        if pinecone_index_rag is None:
+            raise RuntimeError("Pinecone index is not initialized; check the worker's startup logs.")
+        results = pinecone_index_rag.query(
+            vector=query_embedding.tolist(),
+            top_k=top_k,
+            include_metadata=True,
+            filter=docs_filter, # Filter by documents owned by the user
+            **PINECONE_QUERY_KWARGS
+        )
+        pinecone_query_cache.put(key, results)
+    return results
+
+
+def _attach_chunk_contents(matches):
+    """
+    Fills in 'full_content' from DocumentChunk for matches whose Pinecone metadata only carries
+    the document ID and chunk position, with one query on the (document, position) unique index.
+    Returns new match dicts for those matches, so cached Pinecone responses are never mutated.
+    """
+    wanted = set()
+    for match in matches:
+        metadata = match.get('metadata') or {}
+        if not metadata.get('full_content') and metadata.get('document_id') and metadata.get('chunk_position') is not None:
+            wanted.add((int(metadata['document_id']), int(metadata['chunk_position']))) # Pinecone returns numbers as floats
+    if not wanted:
+        return matches
+
+    lookup = reduce(operator.or_, (Q(document_id=document_id, position=position) for document_id, position in wanted))
+    contents = {
+        (document_id, position): content
+        for document_id, position, content in DocumentChunk.objects.filter(lookup).values_list('document_id', 'position', 'content')
+    }
+
+    attached = []
+    for match in matches:
+        metadata = match.get('metadata') or {}
+        if not metadata.get('full_content') and metadata.get('document_id') and metadata.get('chunk_position') is not None:
+            content = contents.get((int(metadata['document_id']), int(metadata['chunk_position'])))
+            if content is not None:
+                match = {'id': match.get('id'), 'score': match.get('score'), 'metadata': {**metadata, 'full_content': content}}
+        attached.append(match)
+    return attached
+
+
+def _load_local_chunk_matrix(document_ids):
+    """
+    Loads the stored embeddings of the documents' chunks as (chunk IDs, float32 matrix), or ([], None) when they
+    have no chunks yet. Returns False when they hold more than RAG_LOCAL_SEARCH_MAX_CHUNKS chunks, some chunk
+    has no stored embedding, or some chunk was embedded by a different model than the one embedding questions
+    in this process.
+    """
+    chunks = DocumentChunk.objects.filter(document_id__in=document_ids)
+    counts = chunks.aggregate(
+        total=Count('id'),
+        missing=Count('id', filter=Q(embedding__isnull=True)),
+        other_model=Count('id', filter=~Q(document__embedding_model=embedding_model_name_rag)),
+    )
+    if counts['total'] > settings.RAG_LOCAL_SEARCH_MAX_CHUNKS or counts['missing'] or counts['other_model']:
+        return False
+
+    rows = list(chunks.values_list('id', 'embedding'))
+    if not rows:
+        return [], None # Documents still pending or failed: nothing to search yet
+    matrix = np.frombuffer(b"".join(bytes(embedding) for _, embedding in rows), dtype=np.float32).reshape(len(rows), -1)
+    return [chunk_id for chunk_id, _ in rows], matrix
+
+
+def _local_chunk_search(user_id, docs_filter, query_embedding, top_k):
+    """
+    Searches the embeddings stored on DocumentChunk with one matrix-vector product and returns the
+    top `top_k` matches in Pinecone's response shape. The user's matrix is loaded once per document
+    version and kept in this worker process. Returns None when the chunks can't be searched locally
+    (see _load_local_chunk_matrix), so Pinecone is used.
+    """
+    if settings.RAG_LOCAL_SEARCH_MAX_CHUNKS <= 0 or embedding_model_name_rag is None:
+        return None
+    key = (user_id, get_user_doc_version(user_id))
+    loaded = local_chunk_matrix_cache.get(key)
+    if loaded is None:
+        loaded = _load_local_chunk_matrix(docs_filter['document_id']['$in'])
+        local_chunk_matrix_cache.put(key, loaded)
+    if loaded is False:
+        return None
+
+    chunk_ids, matrix = loaded
+    if not chunk_ids:
+        return {'matches': []}
+    scores = matrix @ query_embedding # Stored and query vectors are both L2-normalized
+    top = np.argsort(-scores)[:top_k]
+
+    # Text and metadata only for the winners
+    details = {
+        chunk_id: (document_id, filename, position, content)
+        for chunk_id, document_id, filename, position, content in DocumentChunk.objects.filter(id__in=[chunk_ids[i] for i in top])
+            .values_list('id', 'document_id', 'document__filename', 'position', 'content')
+    }
+    matches = []
+    for i in top:
+        if chunk_ids[i] not in details:
+            continue # Deleted after the matrix was loaded
+        document_id, filename, position, content = details[chunk_ids[i]]
+        matches.append({
+            'id': f"doc_{document_id}_chunk_{position}",
+            'score': float(scores[i]),
+            'metadata': {
+                'document_id': str(document_id),
+                'filename': filename,
+                'chunk_position': position,
+                'full_content': content,
+            }
+        })
+    return {'matches': matches}
+
+
+def _broadcast_ai_message(channel_layer, ai_chat_message):
+    """
+    Pushes a saved AI message to its session's Channels group, in the same shape as ChatMessageSerializer.
+    """
+    # Build the payload directly from the in-memory message
+    timestamp = ai_chat_message.timestamp.isoformat()
+    if timestamp.endswith('+00:00'):
+        timestamp = timestamp[:-6] + 'Z' # Match DRF's UTC rendering
+    ai_message_data = {
+        'id': ai_chat_message.id,
+        'session': ai_chat_message.session_id,
+        'role': 'ai',
+        'content': ai_chat_message.content,
+        'timestamp': timestamp,
+        'is_helpful': None,
+        'feedback_text': None,
+    }
+    async_to_sync(channel_layer.group_send)(
+        f'chat_{ai_chat_message.session_id}',
+        {
+            'type': 'chat_message', # This matches the 'type' frontend expects in onmessage
+            'message': ai_message_data # Send full serialized data, including id and timestamp
+        }
+    )
+
+
+def generate_ai_response(session_id, user_message_id, user_message_content):
+    """
+    Background task that answers a user's chat message:
+    1. Embed the question and retrieve matching chunks from Pinecone.
+    2. Ask Gemini for an answer grounded in the retrieved context.
+    3. Save the AI message and push it to the session's Channels group.
+    No transaction is held open while the external services are called.
+    """
+    load_rag_resources() # No-op once the model and Pinecone are loaded; retries whatever failed to load
+
+    # Start embedding the question right away, so the forward pass overlaps the session and document lookups
+    query_embedding_future = prefetch_executor.submit(_get_or_compute_embedding, user_message_content)
+
+    try:
+        session = ChatSession.objects.get(id=session_id)
+    except ChatSession.DoesNotExist:
+        logger.warning("RAG: Chat session %s not found for message %s.", session_id, user_message_id)
+        return
+
+    # --- RAG Logic Starts Here ---
+    retrieved_context = []
+    source_citations = [] # To store details for citations (document_id, filename, etc.)
+    docs_filter = None
+    best_score = None # Highest Pinecone similarity among the user's chunks, before thresholding
+    retrieval_failed = False
+    cached_answer = None # Earlier answer to a near-identical question, if any
+
+    try:
+        # Cached Pinecone filter over the documents owned by the current user (None if they have none),
+        # looked up while the question is still being embedded
+        docs_filter = get_user_doc_filter(session.user_id)
+
+        # Get embedding for the user's query
+        query_embedding = query_embedding_future.result(timeout=30)
+        logger.debug("RAG: User query: '%s'", user_message_content)
+        logger.debug("RAG: User query embedding (first 5 values): %s", query_embedding[:5])
+        logger.debug("RAG: User %s document filter: %s", session.user_id, docs_filter)
+
+        # Near-identical questions from this user reuse the earlier answer: no Pinecone or Gemini call
+        if docs_filter:
+            cached_answer = get_cached_answer(session.user_id, embedding_model_name_rag, query_embedding)
+        
+        # Search Pinecone for relevant document chunks
+        if cached_answer is not None:
+            logger.debug("RAG: Answering from the semantic answer cache.")
+            pinecone_results = {'matches': []}
+        elif docs_filter:
+            # Retrieve more candidates initially; small tenants are searched in the database,
+            # others in Pinecone, where repeated questions are served from the cache
+            all_results = _local_chunk_search(session.user_id, docs_filter, query_embedding, top_k=10)
+            if all_results is None:
+                all_results = _cached_pinecone_query(query_embedding, docs_filter, top_k=10)
+            all_matches = all_results.get('matches', [])
+
+            # Threshold all scores in one vectorized pass (matches arrive sorted by score, best first)
+            scores = np.fromiter((match.get('score', 0.0) for match in all_matches), dtype=np.float32, count=len(all_matches))
+            best_score = float(scores.max()) if len(scores) else 0.0
+            selected = np.flatnonzero(scores > 0.7)[:5] # Only keep high-quality matches, top 5
+            if not len(selected):
+                # No strong match: fall back to a lower threshold over the same top-10 response
+                logger.debug("RAG: No matches with high threshold, using lower threshold on the same results")
+                selected = np.flatnonzero(scores > 0.5)[:3]
+
+            # Build a new dict so the cached response is never mutated
+            pinecone_results = {'matches': _attach_chunk_contents([all_matches[i] for i in selected])}
+        else:
+            # If the user has no documents uploaded, we should not query Pinecone as it will return empty results and lead to an irrelevant response from the LLM.
+            # Instead, we set an empty matches list to proceed gracefully.
+            logger.debug("RAG: No user-owned documents found. Setting Pinecone results to empty.")
+            pinecone_results = {'matches': []} 
+
+        logger.debug("RAG: Pinecone matches found: %d (best score: %s)", len(pinecone_results['matches']), best_score)
+        
+        # Process Pinecone results to extract context and citations
+        retrieved_context, source_citations = _select_context(pinecone_results['matches'])
+
+        logger.debug("RAG: Retrieved context chunks count: %d", len(retrieved_context))
+        logger.debug("RAG: Full source_citations list before AI response: %s", source_citations)
+
+    except FuturesTimeoutError:
+        logger.warning("RAG: Retrieval timed out, answering without retrieved context")
+        retrieved_context = []
+        source_citations = []
+        retrieval_failed = True
+    except Exception as e:
+        logger.error("RAG: Error during Pinecone retrieval: %s", e)
+        # Reset context and citations if retrieval fails, so LLM doesn't get bad data
+        retrieved_context = []
+        source_citations = []
+        retrieval_failed = True
+
+    # Skip the Gemini round-trip when there is nothing to ground an answer in
+    canned_response = None
+    if settings.RAG_SKIP_LLM_WHEN_EMPTY and cached_answer is None and not retrieval_failed and not retrieved_context:
+        if not docs_filter:
+            canned_response = NO_DOCUMENTS_RESPONSE
+        elif best_score is not None and best_score < settings.RAG_MIN_ANSWER_SCORE:
+            canned_response = LOW_CONFIDENCE_RESPONSE
+
+    channel_layer = get_channel_layer()
+
+    if cached_answer is not None:
+        full_response_content = cached_answer['content']
+        source_citations = cached_answer['sources']
+    elif canned_response is not None:
+        logger.debug("RAG: Skipping LLM call, replying with canned response: %s", canned_response)
+        full_response_content = canned_response
+    else:
+        # Improved context formatting, joined once instead of growing a string chunk by chunk
+        context_parts = [
+            f"Context {i} (Score: {citation['score']:.3f}, Source: {citation['filename']}):\n{context}\n\n"
+            for i, (context, citation) in enumerate(zip(retrieved_context, source_citations), 1)
+        ]
+        context_str = "".join(context_parts) if context_parts else "No relevant context found in your uploaded documents."
+
+        # Assemble the prompt in one join instead of re-building intermediate strings
+        prompt = "".join([
+            SYSTEM_PROMPT,
+            "\n\n",
+            context_str,
+            "\n\nUser Question: ",
+            user_message_content,
+            "\n\nAnswer:",
+        ])
+        logger.debug("RAG: Full prompt sent to LLM (length: %d chars):\n%s", len(prompt), prompt)
+
+        # Call Gemini API with improved configuration
+        gemini_payload = {
+            "contents": [
+                {
+                    "role": "user",
+                    "parts": [
+                        {"text": prompt}
+                    ]
+                }
+            ],
+            "generationConfig": GEMINI_GENERATION_CONFIG
+        }
+
+        stream_id = f"ai-{user_message_id}" # Lets the frontend group deltas until the saved message arrives
+
+        full_response_content = "Error: Could not get response from LLM." # Default error message
+        try:
+            # Stream the answer (Server-Sent Events) and forward each piece to the WebSocket as it arrives
+            response_parts = []
+            # orjson serializes the (possibly tens of KB) prompt payload and parses each chunk straight from bytes
+            with gemini_session.post(GEMINI_STREAM_URL, headers=GEMINI_HEADERS, data=orjson.dumps(gemini_payload), timeout=(3.05, 30), stream=True) as gemini_response:
+                gemini_response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+
+                for line in gemini_response.iter_lines():
+                    if not line or not line.startswith(b'data:'):
+                        continue # Skip SSE keep-alives and blank separators
+                    chunk_data = orjson.loads(line[len(b'data:'):])
+
+                    # Each chunk has the same structure as a full response: candidates[0].content.parts[0].text
+                    candidates = chunk_data.get('candidates') or [{}]
+                    parts = (candidates[0].get('content') or {}).get('parts') or [{}]
+                    delta = parts[0].get('text')
+                    if not delta:
+                        continue
+
+                    response_parts.append(delta)
+                    async_to_sync(channel_layer.group_send)(
+                        f'chat_{session_id}',
+                        {
+                            'type': 'chat_message_delta',
+                            'message_id': stream_id,
+                            'delta': delta
+                        }
+                    )
+
+            if response_parts:
+                full_response_content = "".join(response_parts)
+                if not retrieval_failed and retrieved_context:
+                    store_answer(session.user_id, embedding_model_name_rag, query_embedding, full_response_content, source_citations)
+            else:
+                logger.warning("RAG: Gemini stream ended without any text.")
+            
+            logger.debug("RAG: Extracted full_response_content: %s", full_response_content)
+            
+        except requests.exceptions.RequestException as e:
+            logger.error("RAG: Error calling Gemini API: Network or HTTP error: %s", e)
+            full_response_content = f"Error communicating with LLM: {e}"
+        except orjson.JSONDecodeError as e:
+            logger.error("RAG: Error decoding JSON from Gemini stream chunk: %s", e)
+            full_response_content = f"Error processing LLM response (JSON decode): {e}"
+        except Exception as e:
+            logger.exception("RAG: An unexpected error occurred during Gemini API call or parsing: %s", e)
+            full_response_content = f"An unexpected LLM error occurred: {e}"
+
+    # --- RAG Logic Ends Here ---
+
+    ai_response_content = full_response_content # Use the generated LLM response
+
+    # Save the AI's response in its own short transaction
+    with atomic():
+        ai_chat_message = ChatMessage.objects.create(
+            session=session,
+            role='ai',
+            content=ai_response_content,
+            # Store retrieved source citations in the message's metadata
+            metadata={'sources': source_citations} if source_citations else None
+        )
+        # Send the AI's response via Channel Layer for real-time update to frontend, only once the row is
+        # committed: no Redis round-trip inside the transaction, and nothing is pushed if it rolls back
+        on_commit(lambda: _broadcast_ai_message(channel_layer, ai_chat_message))
@@ -1,3 +1,459 @@
-from django.test import TestCase
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+import numpy as np
+import orjson
+import redis
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from documents.models import Document, DocumentChunk
+from users.models import User
+from . import tasks
+from . import caches
+from .caches import get_user_doc_filter, get_user_doc_version, get_cached_answer, store_answer, invalidate_user_rag_caches
+from .models import ChatSession, ChatMessage
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+TEST_MODEL = 'test-model' # Embedding model name patched into chat.tasks
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+# The semantic answer cache uses Redis list commands, so its tests need a real Redis; keys are prefixed
+TEST_REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+TEST_REDIS_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': TEST_REDIS_URL, 'KEY_PREFIX': 'test'}}
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(TEST_REDIS_URL, socket_connect_timeout=1).ping()
+    except redis.exceptions.RedisError:
+        return False
+
+
+def unit_vector(seed, dimension=384):
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def make_match(document_id, position, content, score=0.9, filename='notes.txt'):
+    """A query match in Pinecone's response shape"""
+    return {
+        'id': f"doc_{document_id}_chunk_{position}",
+        'score': score,
+        'metadata': {'document_id': str(document_id), 'filename': filename, 'chunk_position': position, 'full_content': content},
+    }
+
+
+class FakeGeminiStream:
+    """Stands in for the streamed requests.Response of a Gemini SSE call"""
+    def __init__(self, *texts):
+        self.lines = [b'data: ' + orjson.dumps({'candidates': [{'content': {'parts': [{'text': text}]}}]}) for text in texts]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+
+class TrimChunkTests(SimpleTestCase):
+    def test_short_text_is_unchanged(self):
+        self.assertEqual(tasks._trim_chunk("One. Two."), "One. Two.")
+
+    def test_cut_after_the_last_full_sentence(self):
+        text = "First sentence. Second sentence. Third sentence."
+        self.assertEqual(tasks._trim_chunk(text, limit=35), "First sentence. Second sentence.")
+
+    def test_hard_cut_without_a_sentence_boundary(self):
+        self.assertEqual(tasks._trim_chunk("x" * 2000), "x" * tasks.CONTEXT_CHUNK_CHARS)
+
+
+class SelectContextTests(SimpleTestCase):
+    def test_keeps_matches_in_order_with_citations(self):
+        context, citations = tasks._select_context([make_match(1, 0, "Alpha.", 0.9), make_match(2, 3, "Beta.", 0.8)])
+        self.assertEqual(context, ["Alpha.", "Beta."])
+        self.assertEqual(citations, [
+            {'document_id': '1', 'filename': 'notes.txt', 'chunk_position': 0, 'score': 0.9},
+            {'document_id': '2', 'filename': 'notes.txt', 'chunk_position': 3, 'score': 0.8},
+        ])
+
+    def test_drops_near_duplicates(self):
+        opening = "Shared opening. " * 20 # Longer than the 256 characters compared
+        matches = [make_match(1, 0, opening + "first tail", 0.9), make_match(2, 0, opening + "second tail", 0.8), make_match(1, 1, "Other.", 0.7)]
+        context, citations = tasks._select_context(matches)
+        self.assertEqual(context, [opening + "first tail", "Other."])
+        self.assertEqual([citation['document_id'] for citation in citations], ['1', '1'])
+
+    def test_trims_each_chunk(self):
+        context, _ = tasks._select_context([make_match(1, 0, "Sentence one. " + "y" * 3000)])
+        self.assertEqual(context, ["Sentence one."])
+
+    def test_stops_at_the_context_budget(self):
+        matches = [make_match(1, i, f"{i}" + "z" * 1399) for i in range(6)]
+        context, citations = tasks._select_context(matches)
+        self.assertEqual(len(context), tasks.CONTEXT_BUDGET_CHARS // 1400)
+        self.assertLessEqual(sum(map(len, context)), tasks.CONTEXT_BUDGET_CHARS)
+        self.assertEqual([citation['chunk_position'] for citation in citations], list(range(len(context))))
+
+    def test_skips_matches_with_incomplete_metadata(self):
+        incomplete = make_match(1, 0, "No filename.")
+        del incomplete['metadata']['filename']
+        context, _ = tasks._select_context([incomplete, make_match(1, 1, "")])
+        self.assertEqual(context, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, RAG_LOCAL_SEARCH_MAX_CHUNKS=0)
+class GenerateAIResponseTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='rag@example.com', password='secret')
+        self.session = ChatSession.objects.create(user=self.user)
+        self.message = ChatMessage.objects.create(session=self.session, role='user', content="What is in my notes?")
+        for target, kwargs in [
+            ('load_rag_resources', {}),
+            ('_get_or_compute_embedding', {'return_value': np.ones(4, dtype=np.float32) / 2}),
+            ('get_cached_answer', {'return_value': None}),
+            ('store_answer', {}),
+        ]:
+            patcher = mock.patch.object(tasks, target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def generate(self):
+        tasks.generate_ai_response(self.session.id, self.message.id, self.message.content)
+        return ChatMessage.objects.get(session=self.session, role='ai')
+
+    def test_documents_without_chunks_get_a_canned_reply(self):
+        Document.objects.create(user=self.user, filename='pending.txt', status='pending')
+        with override_settings(RAG_LOCAL_SEARCH_MAX_CHUNKS=500), \
+                mock.patch.object(tasks, 'embedding_model_name_rag', TEST_MODEL), \
+                mock.patch.object(tasks, '_cached_pinecone_query') as pinecone_query, \
+                mock.patch.object(tasks.gemini_session, 'post') as post:
+            ai_message = self.generate()
+
+        pinecone_query.assert_not_called()
+        post.assert_not_called()
+        self.assertEqual(ai_message.content, tasks.LOW_CONFIDENCE_RESPONSE)
+
+    def test_prompt_holds_each_retrieved_chunk_once(self):
+        document = Document.objects.create(user=self.user, filename='notes.txt')
+        duplicate = "The notes cover quarterly planning. " * 10
+        matches = [make_match(document.id, 0, duplicate, 0.95), make_match(document.id, 4, duplicate, 0.9), make_match(document.id, 2, "Budget is approved.", 0.8)]
+
+        with mock.patch.object(tasks, '_cached_pinecone_query', return_value={'matches': matches}), \
+                mock.patch.object(tasks.gemini_session, 'post', return_value=FakeGeminiStream("Planning ", "and budget.")) as post:
+            ai_message = self.generate()
+
+        prompt = orjson.loads(post.call_args.kwargs['data'])['contents'][0]['parts'][0]['text']
+        self.assertEqual(prompt.count("The notes cover quarterly planning."), 10)
+        self.assertIn("Budget is approved.", prompt)
+        self.assertTrue(prompt.endswith("User Question: What is in my notes?\n\nAnswer:"))
+        self.assertEqual(ai_message.content, "Planning and budget.")
+        self.assertEqual([source['chunk_position'] for source in ai_message.metadata['sources']], [0, 2])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserDocFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='filter@example.com', password='secret')
+
+    def test_no_documents(self):
+        self.assertIsNone(get_user_doc_filter(self.user.id))
+
+    def test_lists_only_the_users_document_ids_sorted(self):
+        documents = [Document.objects.create(user=self.user, filename=f"{i}.txt") for i in range(3)]
+        other = User.objects.create_user(email='other@example.com', password='secret')
+        Document.objects.create(user=other, filename='other.txt')
+        self.assertEqual(get_user_doc_filter(self.user.id), {"document_id": {"$in": sorted(str(d.id) for d in documents)}})
+
+    def test_cached_until_invalidated(self):
+        first = Document.objects.create(user=self.user, filename='first.txt')
+        self.assertEqual(get_user_doc_filter(self.user.id), {"document_id": {"$in": [str(first.id)]}})
+
+        # bulk_create sends no signals, so only an explicit invalidation refreshes the filter
+        second, = Document.objects.bulk_create([Document(user=self.user, filename='second.txt')])
+        self.assertEqual(get_user_doc_filter(self.user.id), {"document_id": {"$in": [str(first.id)]}})
+        invalidate_user_rag_caches(self.user.id)
+        self.assertEqual(get_user_doc_filter(self.user.id), {"document_id": {"$in": sorted([str(first.id), str(second.id)])}})
+
+    def test_saving_or_deleting_a_document_invalidates_it(self):
+        self.assertIsNone(get_user_doc_filter(self.user.id))
+        document = Document.objects.create(user=self.user, filename='new.txt')
+        self.assertEqual(get_user_doc_filter(self.user.id), {"document_id": {"$in": [str(document.id)]}})
+        document.delete()
+        self.assertIsNone(get_user_doc_filter(self.user.id))
+
+
+@skipUnless(redis_available(), "the semantic answer cache needs Redis")
+@override_settings(CACHES=TEST_REDIS_CACHES)
+class AnswerCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='answers@example.com', password='secret')
+        invalidate_user_rag_caches(self.user.id)
+        self.addCleanup(invalidate_user_rag_caches, self.user.id)
+
+    def test_empty_cache(self):
+        self.assertIsNone(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(0)))
+
+    def test_near_identical_question_hits(self):
+        question = unit_vector(0)
+        store_answer(self.user.id, TEST_MODEL, question, "Answer", [{"filename": "a.txt"}])
+        nearby = question + 0.01 * unit_vector(1)
+        self.assertEqual(get_cached_answer(self.user.id, TEST_MODEL, nearby / np.linalg.norm(nearby)), {'content': "Answer", 'sources': [{"filename": "a.txt"}]})
+
+    def test_different_question_misses(self):
+        store_answer(self.user.id, TEST_MODEL, unit_vector(0), "Answer", [])
+        self.assertIsNone(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(1)))
+
+    def test_most_similar_answer_wins(self):
+        first, second = unit_vector(0), unit_vector(1)
+        store_answer(self.user.id, TEST_MODEL, first, "First", [])
+        store_answer(self.user.id, TEST_MODEL, second, "Second", [])
+        self.assertEqual(get_cached_answer(self.user.id, TEST_MODEL, first)['content'], "First")
+        self.assertEqual(get_cached_answer(self.user.id, TEST_MODEL, second)['content'], "Second")
+
+    def test_answers_are_per_user(self):
+        other = User.objects.create_user(email='other@example.com', password='secret')
+        self.addCleanup(invalidate_user_rag_caches, other.id)
+        store_answer(self.user.id, TEST_MODEL, unit_vector(0), "Answer", [])
+        self.assertIsNone(get_cached_answer(other.id, TEST_MODEL, unit_vector(0)))
+
+    def test_answers_are_per_embedding_model(self):
+        store_answer(self.user.id, TEST_MODEL, unit_vector(0), "Answer", [])
+        self.assertIsNone(get_cached_answer(self.user.id, 'other-model', unit_vector(0)))
+        self.assertEqual(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(0))['content'], "Answer")
+
+    def test_invalidation_drops_answers(self):
+        store_answer(self.user.id, TEST_MODEL, unit_vector(0), "Answer", [])
+        invalidate_user_rag_caches(self.user.id)
+        self.assertIsNone(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(0)))
+
+    def test_concurrent_stores_keep_every_entry(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda seed: store_answer(self.user.id, TEST_MODEL, unit_vector(seed), f"Answer {seed}", []), range(40)))
+        for seed in range(40):
+            self.assertEqual(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(seed))['content'], f"Answer {seed}")
+
+    def test_index_keeps_the_most_recent_entries(self):
+        with mock.patch.object(caches, 'ANSWER_CACHE_MAX_ENTRIES', 3):
+            for seed in range(5):
+                store_answer(self.user.id, TEST_MODEL, unit_vector(seed), f"Answer {seed}", [])
+        self.assertIsNone(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(0)))
+        self.assertIsNone(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(1)))
+        self.assertEqual(get_cached_answer(self.user.id, TEST_MODEL, unit_vector(4))['content'], "Answer 4")
+
+
+class ChatMessagesListViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='secret')
+        self.session = ChatSession.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_lists_every_message_in_order(self):
+        for i in range(60):
+            ChatMessage.objects.create(session=self.session, role='user' if i % 2 == 0 else 'ai', content=f"message {i}")
+
+        response = self.client.get(reverse('list_messages', args=[self.session.id]))
+
+        self.assertEqual(response.status_code, 200)
+        # A plain list, not a paginated page: the chat window loads the whole conversation at once
+        self.assertIsInstance(response.data, list)
+        self.assertEqual([message['content'] for message in response.data], [f"message {i}" for i in range(60)])
+        self.assertEqual(set(response.data[0]), {'id', 'session', 'role', 'content', 'timestamp', 'is_helpful', 'feedback_text'})
+
+    def test_empty_session(self):
+        response = self.client.get(reverse('list_messages', args=[self.session.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
+    def test_other_users_session_is_not_found(self):
+        other = User.objects.create_user(email='other@example.com', password='secret')
+        other_session = ChatSession.objects.create(user=other)
+        ChatMessage.objects.create(session=other_session, role='user', content="private")
+
+        response = self.client.get(reverse('list_messages', args=[other_session.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_missing_session_is_not_found(self):
+        response = self.client.get(reverse('list_messages', args=[self.session.id + 1000]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_authentication(self):
+        response = APIClient().get(reverse('list_messages', args=[self.session.id]))
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RAG_LOCAL_SEARCH_MAX_CHUNKS=500)
+class LocalChunkSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='local@example.com', password='secret')
+        for target, new in [
+            ('embedding_model_name_rag', TEST_MODEL),
+            ('local_chunk_matrix_cache', tasks._QueryEmbeddingCache(max_size=64, ttl_seconds=600)),
+        ]:
+            patcher = mock.patch.object(tasks, target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_document(self, vectors, embedding_model=TEST_MODEL, filename='notes.txt'):
+        document = Document.objects.create(user=self.user, filename=filename, status='completed', embedding_model=embedding_model)
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=document, content=f"chunk {i}", position=i, embedding=vector.tobytes())
+            for i, vector in enumerate(vectors)
+        ])
+        return document
+
+    def search(self, query_embedding, top_k=10):
+        return tasks._local_chunk_search(self.user.id, get_user_doc_filter(self.user.id), query_embedding, top_k)
+
+    def test_documents_without_chunks_have_no_matches(self):
+        Document.objects.create(user=self.user, filename='pending.txt', status='pending')
+        self.assertEqual(self.search(unit_vector(0)), {'matches': []})
+
+    def test_ranks_chunks_in_pinecone_shape(self):
+        vectors = [unit_vector(seed) for seed in range(5)]
+        document = self.add_document(vectors)
+
+        matches = self.search(vectors[3], top_k=2)['matches']
+
+        self.assertEqual(len(matches), 2)
+        self.assertEqual(matches[0]['id'], f"doc_{document.id}_chunk_3")
+        self.assertAlmostEqual(matches[0]['score'], 1.0, places=5)
+        self.assertGreater(matches[0]['score'], matches[1]['score'])
+        self.assertEqual(matches[0]['metadata'], {'document_id': str(document.id), 'filename': 'notes.txt', 'chunk_position': 3, 'full_content': "chunk 3"})
+
+    def test_other_embedding_model_falls_back_to_pinecone(self):
+        self.add_document([unit_vector(0)])
+        self.add_document([unit_vector(1)], embedding_model='other-model')
+        self.assertIsNone(self.search(unit_vector(0)))
+
+    def test_missing_embedding_falls_back_to_pinecone(self):
+        document = self.add_document([unit_vector(0)])
+        DocumentChunk.objects.create(document=document, content="no vector", position=1)
+        self.assertIsNone(self.search(unit_vector(0)))
+
+    @override_settings(RAG_LOCAL_SEARCH_MAX_CHUNKS=2)
+    def test_large_tenants_fall_back_to_pinecone(self):
+        self.add_document([unit_vector(seed) for seed in range(3)])
+        self.assertIsNone(self.search(unit_vector(0)))
+
+    def test_matrix_is_reused_until_the_documents_change(self):
+        document = self.add_document([unit_vector(0)])
+        self.assertEqual(len(self.search(unit_vector(0))['matches']), 1)
+
+        # Chunks written without invalidating the user's caches are not seen...
+        DocumentChunk.objects.create(document=document, content="chunk 1", position=1, embedding=unit_vector(1).tobytes())
+        with self.assertNumQueries(1): # Only the winners' text and metadata
+            self.assertEqual(len(self.search(unit_vector(0))['matches']), 1)
+
+        # ...until processing finishes and invalidates them, which rotates the document version
+        version = get_user_doc_version(self.user.id)
+        invalidate_user_rag_caches(self.user.id)
+        self.assertNotEqual(get_user_doc_version(self.user.id), version)
+        self.assertEqual(len(self.search(unit_vector(0))['matches']), 2)
+
+
+class CachedPineconeQueryTests(SimpleTestCase):
+    def setUp(self):
+        self.index = mock.Mock()
+        self.index.query.return_value = {'matches': []}
+        for target, new in [
+            ('pinecone_index_rag', self.index),
+            ('pinecone_query_cache', tasks._QueryEmbeddingCache(max_size=16, ttl_seconds=60)),
+        ]:
+            patcher = mock.patch.object(tasks, target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.docs_filter = {"document_id": {"$in": ["1", "2"]}}
+
+    def test_queries_with_the_original_vector(self):
+        query_embedding = unit_vector(0)
+        tasks._cached_pinecone_query(query_embedding, self.docs_filter, top_k=10)
+        self.assertEqual(self.index.query.call_args.kwargs['vector'], query_embedding.tolist())
+
+    def test_near_identical_vectors_share_a_response(self):
+        query_embedding = unit_vector(0)
+        tasks._cached_pinecone_query(query_embedding, self.docs_filter, top_k=10)
+        nudged = query_embedding.copy()
+        nudged[0] += 1e-4 # Stays in the same int8 bucket
+        tasks._cached_pinecone_query(nudged, self.docs_filter, top_k=10)
+        tasks._cached_pinecone_query(query_embedding, {"document_id": {"$in": ["1"]}}, top_k=10)
+        self.assertEqual(self.index.query.call_count, 2)
+
+
+class FakeEmbeddingModel:
+    """Query model stand-in returning a fixed vector and counting its calls"""
+    def __init__(self, vector):
+        self.vector = vector
+        self.calls = 0
+
+    def encode(self, text, **kwargs):
+        self.calls += 1
+        return self.vector
+
+
+class LoadRAGResourcesTests(SimpleTestCase):
+    def setUp(self):
+        for target in ['embedding_model_rag', 'embedding_model_name_rag', 'pinecone_index_rag', 'pc']:
+            patcher = mock.patch.object(tasks, target, None) # A fresh worker process
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tasks, 'PineconeGRPC', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_resources_are_retried_by_the_next_job(self):
+        model = FakeEmbeddingModel(unit_vector(0))
+        with mock.patch.object(tasks, 'load_query_embedding_model', side_effect=[OSError("download failed"), model]) as load_model, \
+                mock.patch.object(tasks, 'embedding_model_name', return_value=TEST_MODEL), \
+                mock.patch.object(tasks, 'Pinecone', side_effect=[ConnectionError("unreachable"), mock.DEFAULT]) as pinecone:
+            tasks.load_rag_resources()
+            self.assertIsNone(tasks.embedding_model_rag)
+            self.assertIsNone(tasks.pinecone_index_rag)
+
+            tasks.load_rag_resources()
+            self.assertIs(tasks.embedding_model_rag, model)
+            self.assertEqual(tasks.embedding_model_name_rag, TEST_MODEL)
+            self.assertIsNotNone(tasks.pinecone_index_rag)
+
+            tasks.load_rag_resources() # Nothing left to load
+        self.assertEqual(load_model.call_count, 2)
+        self.assertEqual(pinecone.call_count, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def use_model(self, name, model):
+        for target, new in [
+            ('embedding_model_rag', model),
+            ('embedding_model_name_rag', name),
+            ('query_embedding_cache', tasks._QueryEmbeddingCache(max_size=16, ttl_seconds=60)), # A fresh worker process
+        ]:
+            patcher = mock.patch.object(tasks, target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shared_cache_reuses_the_same_models_vector(self):
+        first = FakeEmbeddingModel(unit_vector(0))
+        self.use_model('model-a', first)
+        tasks._get_or_compute_embedding("Shared question?")
+
+        second = FakeEmbeddingModel(unit_vector(1))
+        self.use_model('model-a', second)
+        np.testing.assert_array_equal(tasks._get_or_compute_embedding("shared   QUESTION?"), unit_vector(0))
+        self.assertEqual(second.calls, 0)
+
+    def test_other_models_never_reuse_the_vector(self):
+        self.use_model('model-a', FakeEmbeddingModel(unit_vector(0)))
+        tasks._get_or_compute_embedding("Model specific question?")
+
+        other = FakeEmbeddingModel(unit_vector(1))
+        self.use_model('model-b', other)
+        np.testing.assert_array_equal(tasks._get_or_compute_embedding("Model specific question?"), unit_vector(1))
+        self.assertEqual(other.calls, 1)
@@ -0,0 +1,26 @@
+# backend/chat/workers.py
+
+from importlib import import_module
+from django.db import close_old_connections
+from rq import SimpleWorker
+
+
+class RAGWorker(SimpleWorker):
+    """
+    RQ worker that runs every job in its own long-lived process instead of forking a work horse per job.
+    The chat RAG resources (query embedding model, Pinecone client, Gemini HTTP session, caches) are loaded
+    once when the worker starts and reused by every job (anything that failed to load is retried by the next
+    job); the document embedding model is loaded by the first document job and kept as well. Run several of
+    these processes for concurrency.
+    """
+    def work(self, *args, **kwargs):
+        import_module('chat.tasks').load_rag_resources() # Loads the model and Pinecone client before the first job
+        return super().work(*args, **kwargs)
+
+    def perform_job(self, job, queue):
+        # The process outlives each job, so drop database connections that went stale in between
+        close_old_connections()
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            close_old_connections()
@@ -82,6 +82,15 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Shared cache (Redis) so per-user lookups cached by the web server and the RQ worker
+# are invalidated together when documents change.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -111,13 +120,57 @@ PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
 PINECONE_ENVIRONMENT = os.environ.get('PINECONE_ENVIRONMENT')
 PINECONE_INDEX_NAME = os.environ.get('PINECONE_INDEX_NAME')
 
+# Quantized ONNX build of all-MiniLM-L6-v2 used for query embeddings (falls back to SentenceTransformer)
+RAG_ONNX_MODEL_ID = os.environ.get('RAG_ONNX_MODEL_ID', 'sentence-transformers/all-MiniLM-L6-v2')
+RAG_ONNX_SUBFOLDER = os.environ.get('RAG_ONNX_SUBFOLDER', 'onnx')
+RAG_ONNX_FILE_NAME = os.environ.get('RAG_ONNX_FILE_NAME', 'model_qint8_avx2.onnx')
+# Optional Model2Vec model distilled from all-MiniLM-L6-v2 (see the distill_static_embedding_model command)
+RAG_STATIC_MODEL_PATH = os.environ.get('RAG_STATIC_MODEL_PATH', '')
+
+# Answer without calling Gemini when the user has no documents or nothing scores above RAG_MIN_ANSWER_SCORE
+RAG_SKIP_LLM_WHEN_EMPTY = os.environ.get('RAG_SKIP_LLM_WHEN_EMPTY', 'True').lower() == 'true'
+RAG_MIN_ANSWER_SCORE = float(os.environ.get('RAG_MIN_ANSWER_SCORE', '0.3'))
+# Upsert chunk vectors to Pinecone as int8-scaled integers (smaller JSON payloads with the REST client;
+# the gRPC client already sends packed float32); only valid for a cosine index
+RAG_UPSERT_INT8 = os.environ.get('RAG_UPSERT_INT8', 'False').lower() == 'true'
+# Users with at most this many chunks are searched in the worker (stored embeddings, loaded once per document
+# change) instead of Pinecone, when their chunks were embedded by the query model; 0 disables
+RAG_LOCAL_SEARCH_MAX_CHUNKS = int(os.environ.get('RAG_LOCAL_SEARCH_MAX_CHUNKS', '500'))
+
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 GEMINI_API_BASE_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent'
+GEMINI_STREAM_API_BASE_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:streamGenerateContent'
 GEMINI_MODEL_NAME = "gemini-2.0-flash"
 
+# RAG diagnostics are logged at DEBUG; set RAG_LOG_LEVEL=DEBUG to see them (INFO keeps production quiet)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['console'],
+            'level': os.environ.get('RAG_LOG_LEVEL', 'INFO'),
+        },
+        'documents': {
+            'handlers': ['console'],
+            'level': os.environ.get('RAG_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE stay in memory; larger ones are streamed to a temp file on the
+# same filesystem as MEDIA_ROOT, so saving the document is a rename instead of a second full copy.
+# The directory is created by DocumentsConfig.ready().
+FILE_UPLOAD_TEMP_DIR = MEDIA_ROOT / 'tmp'
+
 # Django-RQ configuration
 # RQ_QUEUES = {
 #     'default': {
@@ -139,6 +192,11 @@ RQ_QUEUES = {
         'DEFAULT_TIMEOUT': 360,
     }
 }
+# Workers run jobs in one long-lived process (no fork per job), so the RAG models and clients
+# are loaded once per worker instead of once per chat message
+RQ = {
+    'WORKER_CLASS': 'chat.workers.RAGWorker',
+}
 # Add RQ_FORK for Windows compatibility during local dev, keep for Render (Linux) too
 RQ_FORK = False
 
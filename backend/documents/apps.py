@@ -1,5 +1,10 @@
 # backend/documents/apps.py
+import logging
+import os
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -7,4 +12,11 @@ class DocumentsConfig(AppConfig):
 
     def ready(self):
         # Import signals here so they are connected when the app is ready
-        import documents.signals
\ No newline at end of file
+        import documents.signals
+
+        # Large uploads are streamed here; it must exist before the first one arrives
+        if settings.FILE_UPLOAD_TEMP_DIR:
+            try:
+                os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+            except OSError as e:
+                logger.warning("Could not create FILE_UPLOAD_TEMP_DIR %s: %s", settings.FILE_UPLOAD_TEMP_DIR, e)
\ No newline at end of file
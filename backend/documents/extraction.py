@@ -0,0 +1,103 @@
+# backend/documents/extraction.py
+
+import math
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import iterparse
+import fitz # For PDF parsing (PyMuPDF)
+
+# Below this many pages, starting worker processes costs more than it saves
+PARALLEL_PDF_MIN_PAGES = 64
+# Smallest page range handed to a worker; ranges are smaller than pages/workers so the first ones finish early
+PDF_MIN_PAGES_PER_RANGE = 16
+PDF_MAX_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(os.cpu_count() or 1, 8))))
+
+# WordprocessingML tags read by extract_docx_text
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_DOCX_PARAGRAPH, _DOCX_TEXT, _DOCX_TAB = _W + 'p', _W + 't', _W + 'tab'
+_DOCX_BREAKS = (_W + 'br', _W + 'cr')
+
+
+def _extract_pdf_page_range(file_path, start, stop):
+    """
+    Runs in a worker process: opens the PDF itself (MuPDF documents can't be shared between processes)
+    and returns the text of pages [start, stop).
+    """
+    with fitz.open(file_path) as doc:
+        return "".join([doc.load_page(i).get_text("text", sort=False) or '' for i in range(start, stop)])
+
+
+def iter_pdf_text(file_path):
+    """
+    Yields the plain text of a PDF in page order, one piece per page range. Large PDFs are split into
+    contiguous page ranges parsed by several worker processes at once; each piece is yielded as soon as
+    it and every earlier one are done, so the caller can work on the first pages while later ones are parsed.
+    """
+    with fitz.open(file_path) as doc:
+        page_count = doc.page_count
+        in_process = page_count < PARALLEL_PDF_MIN_PAGES or PDF_MAX_WORKERS < 2
+        text = "".join([page.get_text("text", sort=False) or '' for page in doc]) if in_process else None
+    if in_process:
+        yield text
+        return
+
+    # About four ranges per worker, so the pieces arrive steadily instead of all at the end
+    pages_per_range = max(PDF_MIN_PAGES_PER_RANGE, math.ceil(page_count / (PDF_MAX_WORKERS * 4)))
+    ranges = [(start, min(start + pages_per_range, page_count)) for start in range(0, page_count, pages_per_range)]
+    # 'spawn' keeps the workers from inheriting the RQ worker's loaded models and thread pools
+    with ProcessPoolExecutor(max_workers=min(PDF_MAX_WORKERS, len(ranges)), mp_context=multiprocessing.get_context('spawn')) as executor:
+        yield from executor.map(_extract_pdf_page_range, [file_path] * len(ranges), *zip(*ranges))
+
+
+def extract_pdf_text(file_path):
+    """
+    Returns the plain text of a PDF, page by page in order (see iter_pdf_text).
+    """
+    return "".join(iter_pdf_text(file_path))
+
+
+def extract_docx_text(file_path):
+    """
+    Returns the text of a DOCX body, one line per paragraph, streamed from word/document.xml
+    without building python-docx's object tree. Runs are joined as python-docx's paragraph.text
+    joins them (tabs and line breaks kept); paragraphs inside tables are included too.
+    """
+    paragraphs = []
+    parts = []
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml_file:
+        for _, elem in iterparse(xml_file, events=('end',)):
+            tag = elem.tag
+            if tag == _DOCX_TEXT:
+                parts.append(elem.text or '')
+            elif tag == _DOCX_TAB:
+                parts.append('\t')
+            elif tag in _DOCX_BREAKS:
+                parts.append('\n')
+            elif tag == _DOCX_PARAGRAPH:
+                paragraphs.append("".join(parts))
+                parts.clear()
+                elem.clear() # Drop the finished paragraph's subtree so memory stays flat
+    return "\n".join(paragraphs)
+
+
+def read_text_file(file_path):
+    """
+    Returns a TXT/MD file's contents: read as raw bytes with as few syscalls as possible and decoded
+    from UTF-8 in one pass (invalid bytes are replaced rather than failing the document).
+    """
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size)
+        if len(data) < size: # Short read (e.g. very large files); read the remainder
+            chunks = [data]
+            while chunk := os.read(fd, size - sum(len(c) for c in chunks)):
+                chunks.append(chunk)
+            data = b"".join(chunks)
+    finally:
+        os.close(fd)
+    return data.decode('utf-8', errors='replace')
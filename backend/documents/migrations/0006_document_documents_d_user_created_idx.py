@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-15 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_documentchunk_embedding'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['user', '-created_at'], name='documents_d_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-15 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_document_documents_d_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
@@ -12,6 +12,7 @@ class Document(models.Model):
     status = models.CharField(max_length=20, default='pending')
     metadata = models.JSONField(default=dict) # To store extracted metadata like file type, etc.
     created_at = models.DateTimeField(auto_now=True)
+    embedding_model = models.CharField(max_length=100, blank=True, default='', editable=False) # Model behind the stored chunk vectors
     
 
     def __str__(self):
@@ -20,6 +21,9 @@ class Document(models.Model):
     class Meta:
         verbose_name = "Document"
         verbose_name_plural = "Documents"
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='documents_d_user_created_idx'),
+        ]
 
 class DocumentChunk(models.Model):
     """
@@ -28,6 +32,7 @@ class DocumentChunk(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
     content = models.TextField() # The actual text content of the chunk
     position = models.IntegerField() # Order/position of the chunk within the document
+    embedding = models.BinaryField(null=True, blank=True, editable=False) # Normalized float32 vector bytes, for in-DB search on small tenants
 
     def __str__(self):
         return f"Chunk {self.position} of {self.document.filename}"
@@ -35,4 +40,4 @@ class DocumentChunk(models.Model):
     class Meta:
         verbose_name = "Document Chunk"
         verbose_name_plural = "Document Chunks"
-        unique_together = ('document', 'position') 
\ No newline at end of file
+        unique_together = ('document', 'position')
\ No newline at end of file
@@ -1,6 +1,50 @@
 import pinecone
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 
+# Pinecone recommends upserts of at most 100 vectors (and 2 MB) per request
+PINECONE_UPSERT_BATCH_SIZE = 100
+
+# Pinecone deletes by ID accept at most 1000 IDs per request
+PINECONE_DELETE_BATCH_SIZE = 1000
+
+# Parallel upsert requests in flight; the index's connection pool is sized to match
+PINECONE_UPSERT_WORKERS = 8
+
+# Shared by every upload so the Pinecone client's keep-alive connections are reused across tasks
+upsert_executor = ThreadPoolExecutor(max_workers=PINECONE_UPSERT_WORKERS, thread_name_prefix='pinecone-upsert')
+
+def upsert_in_batches(pinecone_index, vectors, batch_size=PINECONE_UPSERT_BATCH_SIZE):
+    """
+    Upserts `vectors` in batches of `batch_size`, sending the batches in parallel.
+    Blocks until every batch is done and re-raises the first failure.
+    """
+    futures = [
+        upsert_executor.submit(pinecone_index.upsert, vectors=vectors[start:start + batch_size])
+        for start in range(0, len(vectors), batch_size)
+    ]
+    for future in futures:
+        future.result()
+
+def delete_in_batches(pinecone_index, ids, batch_size=PINECONE_DELETE_BATCH_SIZE):
+    """
+    Deletes the vectors with the given `ids`, `batch_size` IDs per request.
+    """
+    for start in range(0, len(ids), batch_size):
+        pinecone_index.delete(ids=ids[start:start + batch_size])
+
+def quantize_int8(embedding):
+    """
+    Scales `embedding` so its largest component is +/-127 and rounds it to integers.
+    Returns (values, scale), where values * scale / 127 approximates the original vector.
+    Cosine similarity is scale-invariant, so the integer vector can be upserted as-is
+    to a cosine index: its JSON payload is several times smaller than the float32 digits.
+    """
+    embedding = np.asarray(embedding, dtype=np.float32)
+    scale = float(np.abs(embedding).max()) or 1.0
+    return np.round(embedding / scale * 127).astype(np.int8).tolist(), scale
+
 def initialize_pinecone_index():
     pinecone.init(
         api_key=settings.PINECONE_API_KEY,
@@ -9,7 +53,8 @@ def initialize_pinecone_index():
     if settings.PINECONE_INDEX_NAME not in pinecone.list_indexes():
         pinecone.create_index(
             settings.PINECONE_INDEX_NAME, 
-            dimension=1536  # Replace with the dimension of your embeddings model
+            dimension=384,  # all-MiniLM-L6-v2
+            metric='cosine'
         )
     return pinecone.Index(settings.PINECONE_INDEX_NAME)
 
@@ -24,4 +69,4 @@ def upload_to_pinecone(document_id, text_chunks, embeddings):
                 {'text': chunk, 'document_id': document_id}
             )
         )
-    pinecone_index.upsert(vectors=vectors_to_upsert)
\ No newline at end of file
+    upsert_in_batches(pinecone_index, vectors_to_upsert)
\ No newline at end of file
@@ -1,8 +1,12 @@
 # backend/documents/signals.py
 import os
-from django.db.models.signals import pre_save, post_delete
+import logging
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from .models import Document # Import your Document model
+from chat.caches import invalidate_user_rag_caches
+
+logger = logging.getLogger(__name__)
 
 @receiver(pre_save, sender=Document)
 def auto_delete_file_on_change(sender, instance, **kwargs):
@@ -13,16 +17,20 @@ def auto_delete_file_on_change(sender, instance, **kwargs):
     if not instance.pk: # Object is being created, no old file to delete
         return False
 
-    try:
-        old_file = sender.objects.get(pk=instance.pk).file
-    except sender.DoesNotExist:
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'file' not in update_fields:
+        return False # Partial save that doesn't touch the file
+
+    # Only the stored file name is needed, not the whole row (metadata JSON included)
+    old_file_name = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+    if old_file_name is None:
         return False # Object doesn't exist in DB, nothing to compare
     
-    new_file = instance.file
-    if not old_file == new_file: # Check if the file field has actually changed
-        if os.path.isfile(old_file.path):
-            print(f"Deleting old file: {old_file.path}")
-            os.remove(old_file.path)
+    if old_file_name and old_file_name != instance.file.name: # Check if the file field has actually changed
+        old_file_path = instance.file.storage.path(old_file_name)
+        if os.path.isfile(old_file_path):
+            logger.info("Deleting old file: %s", old_file_path)
+            os.remove(old_file_path)
 
 @receiver(post_delete, sender=Document)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
@@ -31,5 +39,13 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
     if instance.file: # Check if a file is associated
         if os.path.isfile(instance.file.path):
-            print(f"Deleting file on document deletion: {instance.file.path}")
-            os.remove(instance.file.path)
\ No newline at end of file
+            logger.info("Deleting file on document deletion: %s", instance.file.path)
+            os.remove(instance.file.path)
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def invalidate_user_rag_caches_on_change(sender, instance, **kwargs):
+    """
+    Drops the owner's cached Pinecone document filter and cached chat answers.
+    """
+    invalidate_user_rag_caches(instance.user_id)
\ No newline at end of file
@@ -2,72 +2,242 @@
 
 import os
 import io
+import hashlib
 import mimetypes
+from functools import partial
+import numpy as np
 from django.conf import settings
+from django.core.cache import cache
 from .models import Document, DocumentChunk
 from django.db.transaction import atomic
+from .services import upsert_in_batches, delete_in_batches, quantize_int8, PINECONE_UPSERT_WORKERS
+from .extraction import iter_pdf_text, extract_docx_text, read_text_file
 
 # New imports for embeddings and vector database
 from pinecone import Pinecone, PodSpec # Updated import for Pinecone client v2.x.x+
+try:
+    from pinecone.grpc import PineconeGRPC # Installed with the pinecone[grpc] extra
+except ImportError:
+    PineconeGRPC = None
 from sentence_transformers import SentenceTransformer
+import torch
+from chat.embeddings import detect_device, embedding_model_name, OnnxMiniLM
+from chat.caches import invalidate_user_rag_caches
 import fitz # For PDF parsing (PyMuPDF)
 from docx import Document as DocxDocument # For DOCX parsing
 
+import logging
+logger = logging.getLogger(__name__)
+
 # --- Global Initialization for Efficiency ---
-# These will be loaded once when the RQ worker starts,
-# avoiding redundant loading for each task.
+# These are loaded once per RQ worker process, on the first task it runs,
+# avoiding redundant loading for each task. Processes that only import this module
+# to enqueue tasks (the web server) never load the model or open a Pinecone client.
 
 pinecone_index = None
 embedding_model = None
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2' # Part of the embedding cache keys, so vectors from different backends never mix
 pc = None # New Pinecone client instance
 
-try:
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    print("SentenceTransformer model 'all-MiniLM-L6-v2' loaded.")
-except Exception as e:
-    print(f"Error loading SentenceTransformer model: {e}")
-    # Set to None if model loading fails
-
-try:
-    # Initialize Pinecone using the new client instantiation
-    # Use PodSpec if your index is not serverless, otherwise use ServerlessSpec
-    pc = Pinecone(
-        api_key=settings.PINECONE_API_KEY,
-        environment=settings.PINECONE_ENVIRONMENT
-    )
-    # Access the index via the Pinecone client instance
-    pinecone_index = pc.Index(settings.PINECONE_INDEX_NAME)
-    print(f"Pinecone initialized and connected to index: {settings.PINECONE_INDEX_NAME}")
-except Exception as e:
-    print(f"Error initializing Pinecone: {e}")
-    pc = None # Set to None if initialization fails
-    pinecone_index = None # Set to None if initialization fails
+def load_worker_resources():
+    """
+    Loads the embedding model and connects to Pinecone, skipping whichever is already loaded in this process.
+    Called by every task, so a resource whose initialization failed (a model download, Pinecone being
+    unreachable) is retried by the next task instead of disabling ingestion for the rest of the worker's life.
+    Either global stays None while its initialization fails (the task then marks the document as failed).
+    """
+    global pinecone_index, embedding_model, EMBEDDING_MODEL_NAME, pc
+    if embedding_model is None:
+        try:
+            model = None
+            embedding_device = detect_device()
+            if embedding_device == "cpu":
+                # int8 ONNX Runtime kernels instead of fp32 PyTorch eager ones on CPU workers
+                try:
+                    model = OnnxMiniLM(
+                        settings.RAG_ONNX_MODEL_ID,
+                        subfolder=settings.RAG_ONNX_SUBFOLDER,
+                        file_name=settings.RAG_ONNX_FILE_NAME
+                    )
+                    logger.info("Quantized ONNX model '%s' loaded for document embedding.", settings.RAG_ONNX_FILE_NAME)
+                except Exception as e:
+                    logger.warning("ONNX embedding model unavailable, falling back to SentenceTransformer: %s", e)
+            if model is None:
+                model = SentenceTransformer('all-MiniLM-L6-v2', device=embedding_device)
+                model.eval() # Inference only: no dropout
+                if embedding_device == "cuda":
+                    model.half() # fp16 on GPU workers: about twice the throughput at half the memory
+                logger.info("SentenceTransformer model 'all-MiniLM-L6-v2' loaded on '%s'.", embedding_device)
+            EMBEDDING_MODEL_NAME = embedding_model_name(model)
+            embedding_model = model # Only published once fully set up
+        except Exception as e:
+            logger.exception("Error loading SentenceTransformer model: %s", e)
+
+    if pinecone_index is None:
+        try:
+            # Initialize Pinecone using the new client instantiation
+            # Use PodSpec if your index is not serverless, otherwise use ServerlessSpec
+            # The gRPC client sends vectors as packed float32 (4 bytes/value) instead of JSON text; fall back to REST without it
+            pc = (PineconeGRPC or Pinecone)(
+                api_key=settings.PINECONE_API_KEY,
+                environment=settings.PINECONE_ENVIRONMENT
+            )
+            # Access the index via the Pinecone client instance
+            # One pooled connection per parallel upsert batch (see services.upsert_in_batches)
+            pinecone_index = pc.Index(settings.PINECONE_INDEX_NAME, pool_threads=PINECONE_UPSERT_WORKERS)
+            logger.info("Pinecone (%s) initialized and connected to index: %s", 'gRPC' if PineconeGRPC else 'REST', settings.PINECONE_INDEX_NAME)
+        except Exception as e:
+            logger.exception("Error initializing Pinecone: %s", e)
+            pc = None # Set to None if initialization fails
+            pinecone_index = None # Set to None if initialization fails
 
 # --- End Global Initialization ---
 
-def create_chunks_with_overlap(text, chunk_size=1000, overlap=200):
-    """Create overlapping chunks to avoid breaking context"""
-    chunks = []
+# Chunks of processed files, keyed by a digest of the file bytes. Only the (position, text) pairs are kept:
+# a re-uploaded file skips extraction and chunking here, and its vectors come from the per-chunk embedding
+# cache below, so no vector is stored twice.
+DOCUMENT_CONTENT_CACHE_TTL = 24 * 60 * 60
+DOCUMENT_CONTENT_CACHE_MAX_CHUNKS = 5000 # Larger documents (several MB of text) are not cached
+
+def document_content_cache_key(file_path):
+    """
+    Cache key for the chunks of the file at `file_path`: a BLAKE2b digest of its bytes, read in 1 MB blocks.
+    Includes the embedding model, whose tokenizer decides the chunk boundaries.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return f"doc_chunks:{EMBEDDING_MODEL_NAME}:{digest.hexdigest()}"
+
+# Per-chunk embeddings, keyed by the model and a hash of the chunk text; expiry (and Redis eviction) bounds the cache
+CHUNK_EMBEDDING_CACHE_TTL = 7 * 24 * 60 * 60
+
+def chunk_embedding_cache_key(text):
+    return f"chunk_embedding:{EMBEDDING_MODEL_NAME}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+def embed_chunks(texts):
+    """
+    Returns normalized float32 embeddings, one row per text. Vectors cached for the same text and model
+    are reused; only the texts not seen recently are encoded, in one batched forward pass, and cached.
+    """
+    keys = [chunk_embedding_cache_key(text) for text in texts]
+    cached = cache.get_many(set(keys))
+
+    embeddings = np.empty((len(texts), embedding_model.get_sentence_embedding_dimension()), dtype=np.float32)
+    missing = []
+    for row, key in enumerate(keys):
+        vector = cached.get(key)
+        if vector is None:
+            missing.append(row)
+        else:
+            embeddings[row] = np.frombuffer(vector, dtype=np.float32)
+
+    if missing:
+        with torch.inference_mode(): # No autograd bookkeeping for the forward pass
+            embeddings[missing] = embedding_model.encode(
+                [texts[row] for row in missing],
+                batch_size=64,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            ) # fp16 output on GPU is cast to float32 by the assignment
+        cache.set_many({keys[row]: embeddings[row].tobytes() for row in missing}, timeout=CHUNK_EMBEDDING_CACHE_TTL)
+    logger.info("Embedded %d chunks, reused %d cached embeddings.", len(missing), len(texts) - len(missing))
+    return embeddings
+
+def set_document_status(document, status, error=None):
+    """
+    Writes the status (and processing error) with one targeted UPDATE instead of a full save(),
+    skipping the model signals; the in-memory document is kept in sync.
+    """
+    document.status = status
+    fields = {'status': status}
+    if error is not None:
+        document.metadata['processing_error'] = error
+        fields['metadata'] = document.metadata
+    Document.objects.filter(pk=document.pk).update(**fields)
+
+def chunk_spans_with_overlap(text, chunk_size=1000, overlap=200):
+    """(start, end) offsets of the overlapping chunks of `text`; the last span always reaches the end of the text"""
+    spans = []
     start = 0
-    while start < len(text):
+    text_length = len(text)
+    while start < text_length:
         end = start + chunk_size
-        chunk = text[start:end]
         
-        # Avoid breaking words
-        if end < len(text) and text[end] != ' ':
-            last_space = chunk.rfind(' ')
-            if last_space > start + chunk_size // 2:
-                chunk = text[start:start + last_space]
-                end = start + last_space
+        # Avoid breaking words: end at the last space in the second half of the window.
+        # The bounded rfind searches the original string in place, so only the final chunk is ever sliced.
+        if end < text_length and text[end] != ' ':
+            last_space = text.rfind(' ', start + chunk_size // 2 + 1, end)
+            if last_space != -1:
+                end = last_space
         
-        if chunk.strip():
-            chunks.append(chunk.strip())
+        spans.append((start, end))
         
+        if end >= text_length:
+            break # The rest of the text is already in this chunk
         start = end - overlap
-        if start >= len(text):
-            break
     
-    return chunks
+    return spans
+
+def create_chunks_with_overlap(text, chunk_size=1000, overlap=200):
+    """Create overlapping chunks to avoid breaking context"""
+    return spans_to_chunks(text, chunk_spans_with_overlap(text, chunk_size, overlap))
+
+def token_chunk_spans(text, tokenizer, chunk_tokens=256, overlap_tokens=32):
+    """(start, end) character offsets of the token windows of `text` (see create_token_chunks)"""
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)['offset_mapping']
+    spans = []
+    stride = chunk_tokens - overlap_tokens
+    for start in range(0, len(offsets), stride):
+        window = offsets[start:start + chunk_tokens]
+        spans.append((window[0][0], window[-1][1]))
+        if start + chunk_tokens >= len(offsets):
+            break
+    return spans
+
+def create_token_chunks(text, tokenizer, chunk_tokens=256, overlap_tokens=32):
+    """
+    Sliding-window chunks of at most `chunk_tokens` tokens (with `overlap_tokens` shared between neighbours),
+    measured with the embedding model's own tokenizer so no chunk is truncated when it is embedded.
+    Chunks are cut from the original text using the token offsets, so casing and spacing are preserved.
+    """
+    return spans_to_chunks(text, token_chunk_spans(text, tokenizer, chunk_tokens, overlap_tokens))
+
+def spans_to_chunks(text, spans):
+    """The stripped, non-empty text of each span"""
+    return [chunk for chunk in (text[start:end].strip() for start, end in spans) if chunk]
+
+def strip_nul_characters(text_parts, document_id):
+    """Yields the text pieces without NUL characters (0x00), which are illegal in PostgreSQL string literals"""
+    for text_part in text_parts:
+        # The memchr-backed check avoids copying the (usually NUL-free) text at all
+        if '\x00' in text_part:
+            text_part = text_part.translate({0: None})
+            logger.info("Cleaned file content for NUL characters for document: %s", document_id)
+        yield text_part
+
+def iter_part_chunks(text_parts, chunk_spans):
+    """
+    Chunks a text that arrives in pieces (e.g. PDF page ranges) as if it were one string, yielding the chunks
+    completed by each piece. The last window of a piece ends at the piece boundary, not at a chunk boundary,
+    so it is held back and chunked again together with the next piece; chunks (and their overlap) run across
+    the boundaries. `chunk_spans(text)` returns the (start, end) windows of `text`, the last reaching its end.
+    """
+    carry = ''
+    text_parts = iter(text_parts)
+    next_part = next(text_parts, None)
+    while next_part is not None:
+        text = carry + next_part
+        next_part = next(text_parts, None)
+        spans = chunk_spans(text)
+        if next_part is not None and spans:
+            carry = text[spans[-1][0]:]
+            spans = spans[:-1]
+        else:
+            carry = ''
+        yield spans_to_chunks(text, spans)
 
 def process_document_task(document_id):
     """
@@ -81,130 +251,162 @@ def process_document_task(document_id):
     """
     document = None # Initialize document to None for broader scope
     try:
-        document = Document.objects.get(id=document_id)
-        print(f"Starting background processing for document: {document.filename}")
+        # Only the columns the task reads; user is needed for the cache invalidation on completion
+        document = Document.objects.only('id', 'user', 'filename', 'file', 'metadata', 'status').get(id=document_id)
+        logger.info("Starting background processing for document: %s", document.filename)
         
         # Ensure Pinecone and embedding model are available
+        load_worker_resources()
         if pinecone_index is None or embedding_model is None:
             error_msg = "Skipping document processing: Pinecone or Embedding model not initialized. Check server logs."
-            print(error_msg)
-            document.status = 'failed'
-            document.metadata['processing_error'] = error_msg
-            document.save()
+            logger.error(error_msg)
+            set_document_status(document, 'failed', error_msg)
             return
 
         # Change status to processing
-        document.status = 'processing'
-        document.save()
+        set_document_status(document, 'processing')
         
         # Get the full path to the locally stored file
         file_path = document.file.path
         
-        file_content = ""
-        file_extension = document.filename.split('.')[-1].lower()
-
-        # Handle different file types for text extraction
-        if file_extension == 'pdf':
-            doc = fitz.open(file_path)
-            for page in doc:
-                file_content += page.get_text() or '' # Ensure text is not None
-            doc.close() # Close the document after processing
-        elif file_extension == 'docx':
-            doc = DocxDocument(file_path)
-            for paragraph in doc.paragraphs:
-                file_content += paragraph.text + '\n'
-        elif file_extension in ['txt', 'md']:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                file_content = f.read()
+        # Identical files (same bytes) reuse the chunks of an earlier run; their embeddings are per-chunk cache hits
+        content_cache_key = document_content_cache_key(file_path)
+        valid_chunks = cache.get(content_cache_key)
+        if valid_chunks is not None:
+            logger.info("Reusing cached chunks for document: %s", document.id)
+            embeddings = embed_chunks([chunk_content for _, chunk_content in valid_chunks])
         else:
-            print(f"Unsupported file type for document {document.id}: {file_extension}")
-            document.status = 'failed'
-            document.metadata['processing_error'] = f"Unsupported file type: {file_extension}"
-            document.save()
-            return
-
-        if not file_content.strip(): # Use .strip() to check for meaningful content
-            print(f"No text extracted from document {document.id} (or content was empty/whitespace).")
-            document.status = 'failed'
-            document.metadata['processing_error'] = "No text could be extracted or file was empty."
-            document.save()
-            return
-
-        # --- NEW: Clean null characters from extracted content ---
-        # Replace NUL characters (0x00) which are illegal in PostgreSQL string literals
-        file_content = file_content.replace('\x00', '') 
-        print(f"Cleaned file content for NUL characters for document: {document.id}")
-
-        # --- Improved Text Chunking with Overlap ---
-        chunks = create_chunks_with_overlap(file_content, chunk_size=1000, overlap=200)
+            file_extension = document.filename.split('.')[-1].lower()
+
+            # Handle different file types for text extraction
+            # Each extractor produces the text as a sequence of pieces, which are chunked and embedded in order
+            if file_extension == 'pdf':
+                # Plain text in content-stream order; large PDFs arrive page range by page range from several
+                # processes, so embedding the first pages overlaps with parsing the later ones
+                text_parts = iter_pdf_text(file_path)
+            elif file_extension == 'docx':
+                # Streamed from the document XML; no python-docx object tree is built
+                text_parts = [extract_docx_text(file_path)]
+            elif file_extension in ['txt', 'md']:
+                text_parts = [read_text_file(file_path)]
+            else:
+                logger.warning("Unsupported file type for document %s: %s", document.id, file_extension)
+                set_document_status(document, 'failed', f"Unsupported file type: {file_extension}")
+                return
+
+            tokenizer = getattr(embedding_model, 'tokenizer', None)
+            chunks = []
+            valid_chunks = []
+            embedding_parts = []
+
+            # --- Token-aware Text Chunking with Overlap ---
+            if tokenizer is not None and getattr(tokenizer, 'is_fast', False):
+                # Windows fit the model's sequence limit (minus [CLS]/[SEP]), so every token of a chunk is embedded
+                chunk_tokens = min(256, embedding_model.max_seq_length - 2)
+                chunk_spans = partial(token_chunk_spans, tokenizer=tokenizer, chunk_tokens=chunk_tokens, overlap_tokens=32)
+            else:
+                chunk_spans = partial(chunk_spans_with_overlap, chunk_size=1000, overlap=200)
+
+            for part_chunks in iter_part_chunks(strip_nul_characters(text_parts, document.id), chunk_spans):
+                # This check ensures we only process and store non-empty chunks (keeping their document-wide positions)
+                part_valid_chunks = [(len(chunks) + i, chunk_content) for i, chunk_content in enumerate(part_chunks) if chunk_content.strip()]
+                chunks.extend(part_chunks)
+                if part_valid_chunks:
+                    valid_chunks.extend(part_valid_chunks)
+                    # Generate Embeddings for the piece's chunks in one batched forward pass, skipping texts embedded before
+                    embedding_parts.append(embed_chunks([chunk_content for _, chunk_content in part_valid_chunks]))
+
+            if not valid_chunks: # Only whitespace (or nothing) was extracted
+                logger.warning("No text extracted from document %s (or content was empty/whitespace).", document.id)
+                set_document_status(document, 'failed', "No text could be extracted or file was empty.")
+                return
+
+            embeddings = np.concatenate(embedding_parts) if len(embedding_parts) > 1 else embedding_parts[0]
+
+            if len(valid_chunks) <= DOCUMENT_CONTENT_CACHE_MAX_CHUNKS:
+                cache.set(content_cache_key, valid_chunks, DOCUMENT_CONTENT_CACHE_TTL)
+
+        # Prepare data for both relational DB (DocumentChunk) and Pinecone, each list in one comprehension
+        # 1. Chunks for the relational database; the float32 embedding lets chat search small tenants without Pinecone
+        document_chunks_to_create = [
+            DocumentChunk(document=document, content=chunk_content, position=i, embedding=embedding.tobytes())
+            for (i, chunk_content), embedding in zip(valid_chunks, embeddings)
+        ]
+
+        # Pinecone metadata shared by every chunk, built once. The document's own metadata (upload fields,
+        # past processing errors) stays on the Document row rather than being copied into every vector.
+        base_meta = {
+            "document_id": str(document.id),
+            "filename": document.filename,
+            "source_url": document.file.url
+        }
+
+        if settings.RAG_UPSERT_INT8:
+            values_and_quantization = [(values, {"embedding_scale": scale}) for values, scale in map(quantize_int8, embeddings)]
+        else:
+            # One C-level conversion of the whole matrix instead of a .tolist() per chunk
+            values_and_quantization = [(values, {}) for values in embeddings.tolist()]
+
+        # 2. Vectors for Pinecone upsert - the text itself stays in Postgres (DocumentChunk)
+        vector_id_prefix = f"doc_{document.id}_chunk_"
+        vectors_to_upsert = [
+            {
+                "id": f"{vector_id_prefix}{i}",
+                "values": values,
+                "metadata": {
+                    **quantization,
+                    "chunk_position": i,
+                    **base_meta
+                }
+            }
+            for (i, _), (values, quantization) in zip(valid_chunks, values_and_quantization)
+        ]
         
-        # Prepare data for both relational DB (DocumentChunk) and Pinecone
-        document_chunks_to_create = []
-        vectors_to_upsert = []
-
+        # Only the chunk writes run in the transaction; the Pinecone round-trips happen after it commits
         with atomic():
-            # Delete existing chunks for this document before creating new ones
-            DocumentChunk.objects.filter(document=document).delete()
-            print(f"Deleted existing chunks in relational DB for document: {document.id}")
-
-            for i, chunk_content in enumerate(chunks):
-                # This check ensures we only process and store non-empty chunks
-                if not chunk_content.strip():
-                    continue
-
-                # 1. Store chunk in relational database
-                document_chunks_to_create.append(
-                    DocumentChunk(
-                        document=document,
-                        content=chunk_content,
-                        position=i
-                    )
-                )
+            # Re-processing overwrites chunks in place (below); only positions that no longer exist are deleted
+            stale_chunks = DocumentChunk.objects.filter(document=document).exclude(position__in=[i for i, _ in valid_chunks])
+            stale_positions = list(stale_chunks.values_list('position', flat=True))
+            stale_chunks.delete()
+            logger.info("Deleted %d stale chunks in relational DB for document: %s", len(stale_positions), document.id)
 
-                # 2. Generate Embeddings for the chunk
-                embedding = embedding_model.encode([chunk_content])[0].tolist()
-
-                # 3. Prepare vector for Pinecone upsert - Store FULL content
-                vector_id = f"doc_{document.id}_chunk_{i}" 
-                vectors_to_upsert.append({
-                    "id": vector_id,
-                    "values": embedding,
-                    "metadata": {
-                        "document_id": str(document.id),
-                        "filename": document.filename,
-                        "chunk_position": i,
-                        "full_content": chunk_content,  # Store full content for RAG
-                        "content_snippet": chunk_content[:500] + "..." if len(chunk_content) > 500 else chunk_content,
-                        "source_url": document.file.url,
-                        **document.metadata
-                    }
-                })
-            
-            # Bulk create DocumentChunk objects in Django's relational database
+            # Bulk upsert DocumentChunk objects in Django's relational database (INSERT ... ON CONFLICT DO UPDATE)
             if document_chunks_to_create:
-                DocumentChunk.objects.bulk_create(document_chunks_to_create)
-                print(f"Created {len(document_chunks_to_create)} chunks in relational DB for document {document.id}")
+                DocumentChunk.objects.bulk_create(
+                    document_chunks_to_create,
+                    batch_size=1000,
+                    update_conflicts=True,
+                    unique_fields=['document', 'position'],
+                    update_fields=['content', 'embedding']
+                )
+                logger.info("Created %d chunks in relational DB for document %s", len(document_chunks_to_create), document.id)
 
-            # 4. Upsert vectors to Pinecone
-            if vectors_to_upsert:
-                pinecone_index.upsert(vectors=vectors_to_upsert)
-                print(f"Upserted {len(vectors_to_upsert)} vectors to Pinecone for document {document.id}")
-            else:
-                print(f"No valid chunks to upsert to Pinecone for document {document.id}.")
+            # Chat only searches these stored vectors directly when its query model is the same one
+            Document.objects.filter(pk=document.pk).update(embedding_model=EMBEDDING_MODEL_NAME)
+
+        # 3. Upsert vectors to Pinecone (parallel batches of 100)
+        if vectors_to_upsert:
+            upsert_in_batches(pinecone_index, vectors_to_upsert)
+            logger.info("Upserted %d vectors to Pinecone for document %s", len(vectors_to_upsert), document.id)
+        else:
+            logger.info("No valid chunks to upsert to Pinecone for document %s.", document.id)
+
+        # Upserts overwrote the vectors of surviving positions; drop the ones whose chunks were deleted above
+        if stale_positions:
+            delete_in_batches(pinecone_index, [f"{vector_id_prefix}{position}" for position in stale_positions])
+            logger.info("Deleted %d stale vectors from Pinecone for document %s", len(stale_positions), document.id)
 
-        document.status = 'completed'
-        document.save()
-        print(f"Finished processing and chunking for document: {document.filename}. {len(chunks)} chunks created and indexed.")
+        set_document_status(document, 'completed')
+        invalidate_user_rag_caches(document.user_id) # Cached answers predate this document's chunks
+        logger.info("Finished processing and chunking for document: %s. %d chunks created and indexed.", document.filename, len(valid_chunks))
 
     except Document.DoesNotExist:
-        print(f"Document with id {document_id} not found.")
+        logger.warning("Document with id %s not found.", document_id)
     except Exception as e:
         # Capture and store the error message in document metadata for debugging
-        print(f"An error occurred during document processing for document {document_id}: {e}")
+        logger.exception("An error occurred during document processing for document %s: %s", document_id, e)
         if document:
-            document.status = 'failed'
-            document.metadata['processing_error'] = str(e) # Store the error
-            document.save()
+            set_document_status(document, 'failed', str(e)) # Store the error
 
 
 # def process_document_task(document_id):
@@ -1,3 +1,259 @@
-from django.test import TestCase
+import os
+import tempfile
+import zipfile
+from functools import partial
+from unittest import mock
+import numpy as np
+from docx import Document as DocxDocument
+from django.core.files.base import ContentFile
+from django.test import TestCase, SimpleTestCase, override_settings
 
-# Create your tests here.
+from .extraction import extract_docx_text, read_text_file
+from users.models import User
+from . import tasks
+from .models import Document, DocumentChunk
+from .services import quantize_int8
+from .tasks import (
+    create_chunks_with_overlap, create_token_chunks, chunk_spans_with_overlap, token_chunk_spans, iter_part_chunks
+)
+
+
+class WhitespaceTokenizer:
+    """Fast-tokenizer stand-in: one token per whitespace-separated word, with its character offsets"""
+    def __call__(self, text, **kwargs):
+        offsets = []
+        start = None
+        for i, char in enumerate(text + ' '):
+            if char.isspace():
+                if start is not None:
+                    offsets.append((start, i))
+                    start = None
+            elif start is None:
+                start = i
+        return {'offset_mapping': offsets}
+
+
+class OverlapChunkingTests(SimpleTestCase):
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(create_chunks_with_overlap("  hello world  "), ["hello world"])
+
+    def test_empty_text_has_no_chunks(self):
+        self.assertEqual(create_chunks_with_overlap(""), [])
+
+    def test_chunks_overlap_and_end_on_word_boundaries(self):
+        words = [f"word{i}" for i in range(500)]
+        chunks = create_chunks_with_overlap(" ".join(words), chunk_size=100, overlap=20)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 100)
+            self.assertIn(chunk.split(' ')[-1], words)
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertTrue(set(previous.split(' ')) & set(current.split(' '))) # Neighbours share text
+        self.assertEqual(chunks[-1].split(' ')[-1], words[-1])
+
+    def test_hard_cut_without_spaces(self):
+        self.assertEqual(create_chunks_with_overlap("x" * 250, chunk_size=100, overlap=20), ["x" * 100, "x" * 100, "x" * 90])
+
+
+class TokenChunkingTests(SimpleTestCase):
+    def test_windows_of_tokens_with_overlap(self):
+        text = " ".join(f"t{i}" for i in range(10))
+        chunks = create_token_chunks(text, WhitespaceTokenizer(), chunk_tokens=4, overlap_tokens=1)
+        self.assertEqual(chunks, ["t0 t1 t2 t3", "t3 t4 t5 t6", "t6 t7 t8 t9"])
+
+    def test_keeps_original_spacing(self):
+        chunks = create_token_chunks("Alpha\n\nBeta  Gamma", WhitespaceTokenizer(), chunk_tokens=8, overlap_tokens=2)
+        self.assertEqual(chunks, ["Alpha\n\nBeta  Gamma"])
+
+    def test_empty_text_has_no_chunks(self):
+        self.assertEqual(create_token_chunks("   ", WhitespaceTokenizer()), [])
+
+
+class TempFileMixin:
+    def write_temp_file(self, suffix, data):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        self.addCleanup(os.remove, path)
+        return path
+
+
+class DocxExtractionTests(TempFileMixin, SimpleTestCase):
+    def write_docx(self, body):
+        path = self.write_temp_file('.docx', b'')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('word/document.xml', (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>'
+            ))
+        return path
+
+    def test_paragraphs_runs_tabs_and_breaks(self):
+        path = self.write_docx(
+            '<w:p><w:r><w:t>Hello </w:t></w:r><w:r><w:t>world</w:t></w:r></w:p>'
+            '<w:p><w:r><w:t>a</w:t><w:tab/><w:t>b</w:t><w:br/><w:t>c</w:t></w:r></w:p>'
+        )
+        self.assertEqual(extract_docx_text(path), "Hello world\na\tb\nc")
+
+    def test_table_paragraphs_are_included(self):
+        path = self.write_docx('<w:tbl><w:tr><w:tc><w:p><w:r><w:t>cell</w:t></w:r></w:p></w:tc></w:tr></w:tbl>')
+        self.assertEqual(extract_docx_text(path), "cell")
+
+    def test_empty_paragraphs_keep_their_lines(self):
+        path = self.write_docx('<w:p><w:r><w:t>one</w:t></w:r></w:p><w:p/><w:p><w:r><w:t>two</w:t></w:r></w:p>')
+        self.assertEqual(extract_docx_text(path), "one\n\ntwo")
+
+    def test_matches_python_docx_paragraph_text(self):
+        docx = DocxDocument()
+        docx.add_paragraph("Plain paragraph")
+        paragraph = docx.add_paragraph("Bold ")
+        paragraph.add_run("and tabbed\tvalue").bold = True
+        paragraph.add_run().add_break()
+        paragraph.add_run("after break")
+        path = self.write_temp_file('.docx', b'')
+        docx.save(path)
+        self.assertEqual(extract_docx_text(path), "\n".join(p.text for p in DocxDocument(path).paragraphs))
+
+
+class TextFileReadingTests(TempFileMixin, SimpleTestCase):
+    def test_decodes_utf8(self):
+        path = self.write_temp_file('.txt', "Caf\u00e9 \u2014 notes\n".encode('utf-8'))
+        self.assertEqual(read_text_file(path), "Caf\u00e9 \u2014 notes\n")
+
+    def test_replaces_invalid_bytes(self):
+        self.assertEqual(read_text_file(self.write_temp_file('.txt', b"ok \xff end")), "ok \ufffd end")
+
+    def test_empty_file(self):
+        self.assertEqual(read_text_file(self.write_temp_file('.md', b"")), "")
+
+    def test_large_file(self):
+        data = b"line of text\n" * 500000 # About 6.5 MB
+        self.assertEqual(read_text_file(self.write_temp_file('.txt', data)), data.decode('utf-8'))
+
+
+class QuantizeInt8Tests(SimpleTestCase):
+    def test_largest_component_maps_to_127(self):
+        values, scale = quantize_int8([0.5, -0.25, 0.0])
+        self.assertEqual(values, [127, -64, 0])
+        self.assertAlmostEqual(scale, 0.5)
+
+    def test_zero_vector(self):
+        self.assertEqual(quantize_int8([0.0, 0.0]), ([0, 0], 1.0))
+
+    def test_preserves_direction(self):
+        embedding = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+        embedding /= np.linalg.norm(embedding)
+        values, scale = quantize_int8(embedding)
+        restored = np.asarray(values, dtype=np.float32) * scale / 127
+        self.assertGreater(float(restored @ embedding / np.linalg.norm(restored)), 0.999)
+
+
+class PartChunkingTests(SimpleTestCase):
+    def chunk_parts(self, parts, chunk_spans):
+        return [chunk for part_chunks in iter_part_chunks(parts, chunk_spans) for chunk in part_chunks]
+
+    def test_pieces_chunk_like_the_whole_text(self):
+        text = " ".join(f"word{i}" for i in range(3000))
+        parts = [text[start:start + 1700] for start in range(0, len(text), 1700)] # Boundaries fall mid-word
+        chunk_spans = partial(chunk_spans_with_overlap, chunk_size=1000, overlap=200)
+        self.assertEqual(self.chunk_parts(parts, chunk_spans), create_chunks_with_overlap(text, chunk_size=1000, overlap=200))
+
+    def test_token_windows_run_across_pieces(self):
+        text = " ".join(f"t{i}" for i in range(100))
+        parts = [text[start:start + 37] for start in range(0, len(text), 37)]
+        chunk_spans = partial(token_chunk_spans, tokenizer=WhitespaceTokenizer(), chunk_tokens=8, overlap_tokens=2)
+        whole = create_token_chunks(text, WhitespaceTokenizer(), chunk_tokens=8, overlap_tokens=2)
+        self.assertEqual(self.chunk_parts(parts, chunk_spans), whole)
+
+    def test_short_pieces_are_held_until_a_chunk_fills(self):
+        chunk_spans = partial(chunk_spans_with_overlap, chunk_size=1000, overlap=200)
+        self.assertEqual(list(iter_part_chunks(["first page. ", "second page. ", "last page."], chunk_spans)), [[], [], ["first page. second page. last page."]])
+
+    def test_no_pieces(self):
+        self.assertEqual(list(iter_part_chunks([], chunk_spans_with_overlap)), [])
+
+
+class LoadWorkerResourcesTests(SimpleTestCase):
+    def setUp(self):
+        for target in ['embedding_model', 'pinecone_index', 'pc', 'PineconeGRPC']:
+            patcher = mock.patch.object(tasks, target, None) # A fresh worker process
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tasks, 'EMBEDDING_MODEL_NAME', tasks.EMBEDDING_MODEL_NAME)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_resources_are_retried_by_the_next_task(self):
+        model = mock.Mock()
+        with mock.patch.object(tasks, 'detect_device', return_value='cpu'), \
+                mock.patch.object(tasks, 'OnnxMiniLM', side_effect=[OSError("download failed"), model]), \
+                mock.patch.object(tasks, 'SentenceTransformer', side_effect=OSError("download failed")), \
+                mock.patch.object(tasks, 'embedding_model_name', return_value='onnx-test'), \
+                mock.patch.object(tasks, 'Pinecone', side_effect=[ConnectionError("unreachable"), mock.DEFAULT]) as pinecone:
+            tasks.load_worker_resources()
+            self.assertIsNone(tasks.embedding_model)
+            self.assertIsNone(tasks.pinecone_index)
+
+            tasks.load_worker_resources()
+            self.assertIs(tasks.embedding_model, model)
+            self.assertEqual(tasks.EMBEDDING_MODEL_NAME, 'onnx-test')
+            self.assertIsNotNone(tasks.pinecone_index)
+
+            tasks.load_worker_resources() # Nothing left to load
+        self.assertEqual(pinecone.call_count, 2)
+
+
+class FakeEmbeddingModel:
+    """Document model stand-in: 4-dimensional vectors, no tokenizer (so chunking is by characters)"""
+    def __init__(self):
+        self.encoded = 0
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        return np.full((len(texts), 4), 0.5, dtype=np.float32)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, RAG_UPSERT_INT8=False)
+class ProcessDocumentCacheTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.model = FakeEmbeddingModel()
+        for target, new in [
+            ('embedding_model', self.model),
+            ('pinecone_index', mock.Mock()),
+            ('upsert_in_batches', mock.Mock()),
+            ('delete_in_batches', mock.Mock()),
+        ]:
+            patcher = mock.patch.object(tasks, target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email='docs@example.com', password='secret')
+        self.text = " ".join(f"word{i}" for i in range(400))
+
+    def process(self, filename):
+        document = Document(user=self.user, filename=filename)
+        document.file.save(filename, ContentFile(self.text.encode('utf-8')))
+        tasks.process_document_task(document.id)
+        document.refresh_from_db()
+        return document
+
+    def test_identical_file_reuses_chunks_and_their_embeddings(self):
+        first = self.process('first.txt')
+        encoded = self.model.encoded
+        with mock.patch.object(tasks, 'read_text_file') as read_text_file:
+            second = self.process('second.txt')
+
+        read_text_file.assert_not_called()
+        self.assertEqual(self.model.encoded, encoded) # Every vector came from the per-chunk cache
+        self.assertEqual((first.status, second.status), ('completed', 'completed'))
+        chunks = lambda document: list(DocumentChunk.objects.filter(document=document).order_by('position').values_list('position', 'content'))
+        self.assertEqual(chunks(second), chunks(first))
+        self.assertGreater(len(chunks(second)), 1)
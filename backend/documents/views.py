@@ -1,14 +1,17 @@
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import Document, DocumentChunk
+from .models import Document
 from rest_framework.response import Response
 from rest_framework import status
 from .serializers import DocumentSerializer
 from .tasks import process_document_task
 import django_rq
+import logging
 # from django_q.tasks import async_task
 
+logger = logging.getLogger(__name__)
+
 
 class FileUploadView(generics.CreateAPIView):
     queryset = Document.objects.all()
@@ -30,8 +33,7 @@ class FileUploadView(generics.CreateAPIView):
         existing_document = Document.objects.filter(user=user, filename=filename).first()
 
         if existing_document:
-            print(f"Replacing existing document: {filename} (ID: {existing_document.id})")
-            existing_document.chunks.all().delete()
+            logger.info("Replacing existing document: %s (ID: %s)", filename, existing_document.id)
             existing_document.file = uploaded_file 
             existing_document.size = uploaded_file.size
             existing_document.status = 'pending' 
@@ -39,7 +41,7 @@ class FileUploadView(generics.CreateAPIView):
             existing_document.save()
             return existing_document, "Document updated successfully. Processing in background."
         else:
-            print(f"Creating new document: {filename}")
+            logger.info("Creating new document: %s", filename)
             document = serializer.save(
                 user=user, 
                 filename=filename, 
@@ -75,6 +77,4 @@ class DocumentListView(generics.ListAPIView):
         """
         This method ensures that a user can only see their own documents.
         """
-        document = Document.objects.filter(user=self.request.user).first()
-        print(DocumentChunk.objects.filter(document=document))
         return Document.objects.filter(user=self.request.user).order_by('-created_at')
\ No newline at end of file
@@ -42,6 +42,8 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ fetchWithAuth, onClose })
   const [errorMessages, setErrorMessages] = useState<string | null>(null);
   const [sendingMessage, setSendingMessage] = useState<boolean>(false);
   const [sendMessageError, setSendMessageError] = useState<string | null>(null);
+  // AI reply being streamed over the WebSocket, replaced by the saved message once it arrives
+  const [streamingReply, setStreamingReply] = useState<{ id: string; content: string } | null>(null);
 
   const messagesEndRef = useRef<HTMLDivElement>(null); // Ref for auto-scrolling
   const ws = useRef<WebSocket | null>(null); // Ref to hold the WebSocket instance
@@ -156,7 +158,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ fetchWithAuth, onClose })
 
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [messages, streamingReply]);
 
   // --- WebSocket Connection Management ---
   useEffect(() => {
@@ -179,6 +181,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ fetchWithAuth, onClose })
       ws.current.close();
     }
 
+    setStreamingReply(null);
     ws.current = new WebSocket(wsUrl);
 
     ws.current.onopen = () => {
@@ -189,10 +192,23 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ fetchWithAuth, onClose })
       try {
         const receivedData = JSON.parse(event.data);
         console.log('Raw WebSocket message received:', receivedData); // Debug log
+
+        // Partial AI reply: append the delta to the in-progress bubble
+        if (receivedData.type === 'chat_message_delta') {
+          setStreamingReply(prev =>
+            prev && prev.id === receivedData.message_id
+              ? { ...prev, content: prev.content + receivedData.delta }
+              : { id: receivedData.message_id, content: receivedData.delta }
+          );
+          return;
+        }
         
         // The WebSocket message might have a 'message' property containing the actual ChatMessage
         const receivedMessage: ChatMessage = receivedData.message || receivedData;
         console.log('Processed WebSocket message:', receivedMessage); // Debug log
+        if (receivedMessage.role === 'ai') {
+          setStreamingReply(null); // The saved message replaces the streamed preview
+        }
 
         setMessages(prev => {
           const exists = prev.some(msg => msg.id === receivedMessage.id);
@@ -428,6 +444,13 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ fetchWithAuth, onClose })
               );
             })
           )}
+          {/* AI reply still streaming in */}
+          {streamingReply && (
+            <div key={streamingReply.id} className="mb-4 p-3 rounded-lg max-w-3/4 bg-gray-600 mr-auto">
+              <p className="font-semibold text-sm capitalize mb-1">DocAI</p>
+              <p className="text-base whitespace-pre-wrap">{streamingReply.content}</p>
+            </div>
+          )}
           <div ref={messagesEndRef} /> {/* For auto-scrolling */}
         </div>
 